@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for the worksheet capture system
+Drives capture_burst() -> analyze_images() on the simulated backend
+(simulation.py) against the local mock API, sweeping hold time, capture
+resolution and BURST_DELAY. Each configuration runs in its own process
+so peak RSS is measured per configuration.
+
+    python benchmark.py --output results.json
+    python benchmark.py --compare results.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# =====================================================
+# CONFIGURATION
+# =====================================================
+HOLDS = [1.0, 2.0]  # seconds the button is held
+SIZES = [(1536, 864), (2304, 1296)]
+BURST_DELAYS = [0.1, 0.2]
+BURSTS = 5  # bursts per configuration
+BURST_GAP = 1.0  # idle seconds before each press (lets the pre-trigger ring refill)
+API_LATENCY = 0.8  # mock API time to first token
+METRICS = [  # (key, higher is better) compared by --compare
+    ("frames_per_second", True),
+    ("upload_bytes", False),
+    ("release_to_answer_p50_ms", False),
+    ("release_to_answer_p95_ms", False),
+    ("peak_rss_mb", False),
+]
+
+# =====================================================
+# WORKER
+# =====================================================
+
+def current_rss_mb():
+    """Resident set size right now (Linux), or None"""
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def configure(wc, config):
+    """Apply a configuration's resolution and burst delay before the camera comes up"""
+    wc.BURST_DELAY = config["delay"]
+    wc.CAPTURE_SIZE = tuple(config["size"])
+    if wc.LORES_SIZE:
+        wc.LORES_SIZE = (wc.CAPTURE_SIZE[0] // 4, wc.CAPTURE_SIZE[1] // 4)
+    if wc.frame_pool:
+        wc.frame_pool = wc.FramePool(wc.FRAME_POOL_SIZE, wc.CAPTURE_SIZE, wc.LORES_SIZE)
+    wc.RESPONSE_CACHE_MAX_ENTRIES = 0  # every burst shows the same page; measure the API path
+    for name in ("button", "camera", "pretrigger", "haptics"):
+        wc.components.get(name)
+    wc.ping_api()
+
+
+def mock_api_stats(wc):
+    if wc.SIM_API_URL:
+        return None  # an external server; nothing to count
+    return wc.components.get("mock_api").stats
+
+
+def run_burst(wc, hold):
+    """One press-hold-release-answer cycle; returns its measurements"""
+    button = wc.components.get("button")
+    stats = mock_api_stats(wc)
+    threading.Timer(hold, button.release).start()
+    pressed_at = time.monotonic()
+    button.press()
+    frames = wc.capture_burst(pressed_at)
+    spans = wc.current_trace.spans
+
+    first_text = []
+    sent_before = stats["bytes_received"] if stats else None
+    answer = wc.analyze_images(
+        frames, on_text=lambda text: first_text or first_text.append(time.monotonic())
+    )
+    answered = time.monotonic()
+    button.wait_for_release()
+
+    # An adaptive burst can end before the button is released
+    early_stop = next((span for span in spans if span["name"] == "early_stop"), None)
+    ended = pressed_at + early_stop["start"] if early_stop else button.released_at
+
+    captures = [span for span in spans if span["name"] == "capture"]
+    capture_time = 0.0
+    if captures:
+        capture_time = captures[-1]["start"] + captures[-1]["duration"] - captures[0]["start"]
+    return {
+        "ok": answer is not None,
+        "frames": len(captures),
+        "early_stop": early_stop is not None,
+        "frames_per_second": len(captures) / capture_time if capture_time > 0 else 0.0,
+        "upload_bytes": stats["bytes_received"] - sent_before if stats else None,
+        "release_to_first_text": first_text[0] - ended if first_text else None,
+        "release_to_answer": answered - ended,
+    }
+
+
+def percentile_ms(values, q):
+    values = [value for value in values if value is not None]
+    return round(float(np.percentile(values, q)) * 1000, 1) if values else None
+
+
+def mean(values):
+    values = [value for value in values if value is not None]
+    return round(float(np.mean(values)), 2) if values else None
+
+
+def run_worker(config):
+    """Benchmark one configuration in this process and print the result as JSON"""
+    import worksheet_capture as wc
+
+    configure(wc, config)
+    baseline_rss = current_rss_mb()
+
+    bursts = []
+    for _ in range(config["bursts"]):
+        time.sleep(config["gap"])
+        bursts.append(run_burst(wc, config["hold"]))
+
+    answer_latencies = [burst["release_to_answer"] for burst in bursts]
+    result = {
+        **config,
+        "failures": sum(1 for burst in bursts if not burst["ok"]),
+        "frames": mean([burst["frames"] for burst in bursts]),
+        "early_stops": sum(1 for burst in bursts if burst["early_stop"]),
+        "frames_per_second": mean([burst["frames_per_second"] for burst in bursts]),
+        "upload_bytes": mean([burst["upload_bytes"] for burst in bursts]),
+        "release_to_first_text_p50_ms": percentile_ms(
+            [burst["release_to_first_text"] for burst in bursts], 50
+        ),
+        "release_to_answer_p50_ms": percentile_ms(answer_latencies, 50),
+        "release_to_answer_p95_ms": percentile_ms(answer_latencies, 95),
+        "baseline_rss_mb": round(baseline_rss, 1) if baseline_rss is not None else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(json.dumps(result), flush=True)
+
+# =====================================================
+# SWEEP
+# =====================================================
+
+def config_key(config):
+    return (config["hold"], tuple(config["size"]), config["delay"])
+
+
+def run_config(config, args):
+    """Run one configuration in a fresh process with its own HOME"""
+    with tempfile.TemporaryDirectory(prefix="pisolver-bench-") as home:
+        env = {
+            **os.environ,
+            "HOME": home,  # keeps captures, queues and caches out of the real ones
+            "PISOLVER_BACKEND": "sim",
+            "PISOLVER_SIM_HOLDS": "",  # the benchmark presses the button itself
+            "PISOLVER_SIM_API_LATENCY": str(args.api_latency),
+        }
+        if args.images:
+            env["PISOLVER_SIM_IMAGES"] = str(args.images)
+        process = subprocess.run(
+            [sys.executable, __file__, "--worker", json.dumps(config)],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=None if args.verbose else subprocess.DEVNULL,
+            text=True,
+            cwd=Path(__file__).resolve().parent,
+        )
+    if process.returncode != 0 or not process.stdout.strip():
+        return {**config, "error": f"worker exited with {process.returncode}"}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def format_table(results):
+    rows = [
+        f"{'hold':>5}{'size':>11}{'delay':>7}{'frames':>8}{'fps':>7}"
+        f"{'upload KB':>11}{'p50 ms':>9}{'p95 ms':>9}{'RSS MB':>9}"
+    ]
+    for result in results:
+        size = "x".join(str(edge) for edge in result["size"])
+        prefix = f"{result['hold']:>5.1f}{size:>11}{result['delay']:>7.2f}"
+        if "error" in result:
+            rows.append(f"{prefix}  {result['error']}")
+            continue
+        upload = float("nan")
+        if result["upload_bytes"] is not None:
+            upload = result["upload_bytes"] / 1024
+        rows.append(
+            f"{prefix}{result['frames']:>8.1f}{result['frames_per_second']:>7.1f}"
+            f"{upload:>11.0f}{result['release_to_answer_p50_ms']:>9.0f}"
+            f"{result['release_to_answer_p95_ms']:>9.0f}{result['peak_rss_mb']:>9.0f}"
+        )
+    return "\n".join(rows)
+
+
+def compare(results, baseline_path):
+    """Per-configuration change of each metric against a previous run"""
+    baseline = {
+        config_key(result): result
+        for result in json.loads(Path(baseline_path).read_text())["results"]
+        if "error" not in result
+    }
+    rows = [f"Change vs {baseline_path} (+ is better)"]
+    for result in results:
+        previous = baseline.get(config_key(result))
+        if previous is None or "error" in result:
+            continue
+        size = "x".join(str(edge) for edge in result["size"])
+        changes = []
+        for key, higher_is_better in METRICS:
+            old, new = previous.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100 * (1 if higher_is_better else -1)
+            changes.append(f"{key} {change:+.1f}%")
+        label = f"hold {result['hold']}s {size} delay {result['delay']}s"
+        rows.append(f"{label}: " + ", ".join(changes))
+    return "\n".join(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worksheet capture end-to-end benchmark")
+    parser.add_argument("--holds", default=",".join(map(str, HOLDS)), help="button hold seconds")
+    parser.add_argument(
+        "--sizes", default=",".join(f"{w}x{h}" for w, h in SIZES), help="capture resolutions, WxH"
+    )
+    parser.add_argument(
+        "--delays", default=",".join(map(str, BURST_DELAYS)), help="BURST_DELAY values"
+    )
+    parser.add_argument("--bursts", type=int, default=BURSTS, help="bursts per configuration")
+    parser.add_argument(
+        "--gap", type=float, default=BURST_GAP, help="idle seconds before each press"
+    )
+    parser.add_argument(
+        "--api-latency", type=float, default=API_LATENCY, help="mock time to first token"
+    )
+    parser.add_argument("--images", type=Path, help="directory of worksheet photos to replay")
+    parser.add_argument("--output", "-o", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, help="previous results JSON to compare against")
+    parser.add_argument("--verbose", "-v", action="store_true", help="show worker logs")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(json.loads(args.worker))
+        return
+
+    configs = [
+        {"hold": hold, "size": size, "delay": delay, "bursts": args.bursts, "gap": args.gap}
+        for hold, size, delay in itertools.product(
+            [float(hold) for hold in args.holds.split(",")],
+            [[int(edge) for edge in size.split("x")] for size in args.sizes.split(",")],
+            [float(delay) for delay in args.delays.split(",")],
+        )
+    ]
+
+    results = []
+    for number, config in enumerate(configs, 1):
+        print(
+            f"[{number}/{len(configs)}] hold {config['hold']}s, "
+            f"{config['size'][0]}x{config['size'][1]}, delay {config['delay']}s",
+            file=sys.stderr,
+        )
+        results.append(run_config(config, args))
+
+    print(format_table(results))
+    if args.compare:
+        print(compare(results, args.compare))
+    if args.output:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "api_latency": args.api_latency,
+            "images": str(args.images) if args.images else None,
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
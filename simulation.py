@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Hardware-free stand-ins for the worksheet capture system
+Camera, button and haptics that behave like Picamera2, gpiozero and the
+DRV2605 driver, plus a local HTTP server that speaks the Messages API
+
+    PISOLVER_BACKEND=sim python worksheet_capture.py
+"""
+
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# LIBCAMERA CONTROLS
+# =====================================================
+
+class controls:
+    """The subset of libcamera.controls the capture code uses"""
+
+    class AfModeEnum:
+        Manual = 0
+        Auto = 1
+        Continuous = 2
+
+    class AfStateEnum:
+        Idle = 0
+        Scanning = 1
+        Focused = 2
+        Failed = 3
+
+# =====================================================
+# CAMERA
+# =====================================================
+
+def synthetic_worksheet(size, seed=0):
+    """A light page of dark text lines on a dark desk, as an RGB array"""
+    width, height = size
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, (60, 50, 45))
+    draw = ImageDraw.Draw(image)
+
+    page = [
+        (width * 0.22, height * 0.08),
+        (width * 0.78, height * 0.10),
+        (width * 0.76, height * 0.95),
+        (width * 0.20, height * 0.92),
+    ]
+    draw.polygon(page, fill=(235, 232, 225))
+
+    line_height = max(4, height // 30)
+    for row in range(3, 26):
+        y = height * 0.08 + row * line_height
+        x = width * 0.27
+        while x < width * 0.70:
+            word = rng.randint(2, 8) * line_height // 3
+            draw.rectangle([x, y, x + word, y + line_height // 2], fill=(30, 30, 35))
+            x += word + line_height // 2
+    return np.asarray(image)
+
+
+class SimRequest:
+    """A completed request: one frame from each configured stream"""
+
+    def __init__(self, arrays, metadata):
+        self._arrays = arrays
+        self._metadata = metadata
+
+    def make_array(self, name):
+        return self._arrays[name]
+
+    def get_metadata(self):
+        return dict(self._metadata)
+
+    def release(self):
+        pass
+
+
+class SimCamera:
+    """Picamera2 stand-in that replays images at a fixed frame rate
+
+    Images come from image_dir (cycled in name order) or, without one, a
+    synthetic worksheet. Each frame gets a small random shift and sensor
+    noise, so burst frames are near-identical but not equal.
+    """
+
+    def __init__(self, image_dir=None, fps=30.0, jitter=4, noise=3.0):
+        self._image_dir = Path(image_dir) if image_dir else None
+        self._interval = 1.0 / fps
+        self._jitter = jitter
+        self._noise = noise
+        self._rng = np.random.default_rng(0)
+        self._lock = threading.Lock()
+        self._next_frame = time.monotonic()
+        self._count = 0
+        self._sources = []
+        self._noise_fields = []
+        self._sizes = {}
+        self.controls = {}
+
+    def create_still_configuration(self, main=None, lores=None, buffer_count=1, **kwargs):
+        return {"main": main, "lores": lores, "buffer_count": buffer_count}
+
+    create_video_configuration = create_still_configuration
+
+    def configure(self, config):
+        self._sizes = {
+            name: tuple(stream["size"])
+            for name, stream in config.items()
+            if name in ("main", "lores") and stream
+        }
+        width, height = self._sizes["main"]
+        margin = 2 * self._jitter
+        padded = (width + margin, height + margin)
+
+        paths = sorted(self._image_dir.glob("*.jp*g")) if self._image_dir else []
+        paths += sorted(self._image_dir.glob("*.png")) if self._image_dir else []
+        if paths:
+            self._sources = [
+                np.asarray(Image.open(path).convert("RGB").resize(padded, Image.BILINEAR))
+                for path in paths
+            ]
+        else:
+            self._sources = [synthetic_worksheet(padded)]
+        # A few precomputed noise fields keep frame generation cheap
+        self._noise_fields = [
+            self._rng.normal(0, self._noise, size=(height, width, 1)).astype(np.int16)
+            for _ in range(4 if self._noise else 0)
+        ]
+        logger.info(f"Simulated camera: {len(self._sources)} source images at {width}x{height}")
+
+    def start(self):
+        self._next_frame = time.monotonic()
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+    def set_controls(self, new_controls):
+        self.controls.update(new_controls)
+
+    def autofocus_cycle(self):
+        time.sleep(0.3)  # a typical contrast-detect AF sweep
+        return True
+
+    def _next_arrays(self):
+        """Wait for the next frame slot, then render main (and lores) images"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_frame:
+                time.sleep(self._next_frame - now)
+            self._next_frame = max(now, self._next_frame) + self._interval
+            source = self._sources[(self._count // 30) % len(self._sources)]
+            self._count += 1
+
+        width, height = self._sizes["main"]
+        dy, dx = self._rng.integers(0, 2 * self._jitter + 1, size=2)
+        main = source[dy:dy + height, dx:dx + width]
+        if self._noise_fields:
+            noise = self._noise_fields[self._count % len(self._noise_fields)]
+            main = np.clip(main + noise, 0, 255).astype(np.uint8)
+        else:
+            main = main.copy()
+
+        arrays = {"main": main}
+        if "lores" in self._sizes:
+            lores_width, lores_height = self._sizes["lores"]
+            step_y, step_x = height // lores_height, width // lores_width
+            luma = main[::step_y, ::step_x][:lores_height, :lores_width].mean(axis=2)
+            # YUV420 layout: Y plane followed by quarter-size U and V planes
+            chroma = np.full((lores_height // 2, lores_width), 128, dtype=np.uint8)
+            arrays["lores"] = np.vstack([luma.astype(np.uint8), chroma])
+        return arrays
+
+    def _metadata(self):
+        return {
+            "AfState": controls.AfStateEnum.Focused,
+            "LensPosition": 3.0,
+            "SensorTimestamp": time.monotonic_ns(),
+        }
+
+    def capture_request(self):
+        return SimRequest(self._next_arrays(), self._metadata())
+
+    def capture_array(self, name="main"):
+        return self._next_arrays()[name]
+
+    def capture_file(self, path):
+        Image.fromarray(self._next_arrays()["main"]).save(path, quality=95)
+        return self._metadata()
+
+# =====================================================
+# BUTTON
+# =====================================================
+
+class SimButton:
+    """gpiozero Button stand-in driven by a script or by press()/release()
+
+    holds is a list of hold durations in seconds; each press follows the
+    previous release by gap seconds. finished is set after the last release.
+    released_at is the time.monotonic() of the most recent release.
+    """
+
+    def __init__(self, holds=(), gap=1.0, start_delay=1.0):
+        self.when_pressed = None
+        self.released_at = None
+        self.finished = threading.Event()
+        self._holds = list(holds)
+        self._gap = gap
+        self._start_delay = start_delay
+        self._pressed = threading.Event()
+        self._released = threading.Event()
+        self._released.set()
+        if self._holds:
+            threading.Thread(target=self._run, name="sim-button", daemon=True).start()
+
+    @property
+    def is_pressed(self):
+        return self._pressed.is_set()
+
+    def wait_for_press(self, timeout=None):
+        return self._pressed.wait(timeout)
+
+    def wait_for_release(self, timeout=None):
+        return self._released.wait(timeout)
+
+    def press(self):
+        self._released.clear()
+        self._pressed.set()
+        if self.when_pressed:
+            self.when_pressed()
+
+    def release(self):
+        self.released_at = time.monotonic()
+        self._pressed.clear()
+        self._released.set()
+
+    def _run(self):
+        time.sleep(self._start_delay)
+        for hold in self._holds:
+            self.press()
+            time.sleep(hold)
+            self.release()
+            time.sleep(self._gap)
+        self.finished.set()
+
+# =====================================================
+# HAPTICS
+# =====================================================
+
+class SimHaptics:
+    """DRV2605 stand-in: accepts sequences and play/stop, feels nothing"""
+
+    class Effect:
+        def __init__(self, effect_id):
+            self.id = effect_id
+
+    def __init__(self):
+        self.sequence = [None] * 8
+        self.plays = 0
+
+    def play(self):
+        self.plays += 1
+
+    def stop(self):
+        pass
+
+# =====================================================
+# MESSAGES API
+# =====================================================
+
+SIM_ANSWER = (
+    "The worksheet shows three arithmetic problems. "
+    "Step one: 12 plus 7 is 19. "
+    "Step two: 45 minus 18 is 27. "
+    "Step three: 6 times 8 is 48. "
+    "The answers are 19, 27 and 48."
+)
+
+
+class MockAnthropicServer:
+    """Local stand-in for the Anthropic API with configurable latency
+
+    Serves /v1/messages (plain and streamed), /v1/models and /v1/files.
+    first_token_latency is the delay before the first text arrives;
+    token_interval is the delay between streamed words. stats counts
+    requests (including file deletions) and bytes received.
+    """
+
+    def __init__(self, first_token_latency=0.8, token_interval=0.03, port=0):
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.stats = {"messages": 0, "files": 0, "deletes": 0, "pings": 0, "bytes_received": 0}
+        self._file_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(
+            target=self._server.serve_forever, name="mock-api", daemon=True
+        ).start()
+        logger.info(f"Mock API listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, key, body_bytes):
+        with self._lock:
+            self.stats[key] += 1
+            self.stats["bytes_received"] += body_bytes
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+            def log_message(self, format, *args):
+                pass
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def _json(self, payload, status=200):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _event(self, name, payload):
+                self._chunk(f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+            def do_GET(self):
+                if self.path.startswith("/v1/models"):
+                    server._count("pings", 0)
+                    model = {
+                        "type": "model",
+                        "id": "claude-sim",
+                        "display_name": "Simulated",
+                        "created_at": "2025-01-01T00:00:00Z",
+                    }
+                    self._json(
+                        {"data": [model], "has_more": False,
+                         "first_id": model["id"], "last_id": model["id"]}
+                    )
+                else:
+                    self._json({"type": "error", "error": {"type": "not_found_error"}}, 404)
+
+            def do_DELETE(self):
+                file_id = self.path.rsplit("/", 1)[-1]
+                server._count("deletes", 0)
+                self._json({"id": file_id, "type": "file_deleted"})
+
+            def do_POST(self):
+                body = self._body()
+                if self.path.startswith("/v1/files"):
+                    server._count("files", len(body))
+                    self._json(
+                        {
+                            "id": f"file_sim_{next(server._file_ids)}",
+                            "type": "file",
+                            "filename": "frame.jpg",
+                            "mime_type": "image/jpeg",
+                            "size_bytes": len(body),
+                            "created_at": "2025-01-01T00:00:00Z",
+                            "downloadable": False,
+                        }
+                    )
+                elif self.path.startswith("/v1/messages"):
+                    server._count("messages", len(body))
+                    self._messages(json.loads(body))
+                else:
+                    self._json({"type": "error", "error": {"type": "not_found_error"}}, 404)
+
+            def _messages(self, request):
+                images = sum(
+                    1
+                    for message in request.get("messages", [])
+                    for block in message.get("content", [])
+                    if isinstance(block, dict) and block.get("type") == "image"
+                )
+                usage = {
+                    "input_tokens": 100 + 1500 * images,
+                    "output_tokens": len(SIM_ANSWER.split()),
+                    "cache_creation_input_tokens": 0,
+                    "cache_read_input_tokens": 0,
+                }
+                message = {
+                    "id": "msg_sim",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": request.get("model", "claude-sim"),
+                    "stop_reason": None,
+                    "stop_sequence": None,
+                }
+                time.sleep(server.first_token_latency)
+
+                if not request.get("stream"):
+                    time.sleep(server.token_interval * usage["output_tokens"])
+                    self._json(
+                        {
+                            **message,
+                            "content": [{"type": "text", "text": SIM_ANSWER}],
+                            "stop_reason": "end_turn",
+                            "usage": usage,
+                        }
+                    )
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                self._event(
+                    "message_start",
+                    {
+                        "type": "message_start",
+                        "message": {
+                            **message,
+                            "content": [],
+                            "usage": {**usage, "output_tokens": 1},
+                        },
+                    },
+                )
+                self._event(
+                    "content_block_start",
+                    {"type": "content_block_start", "index": 0,
+                     "content_block": {"type": "text", "text": ""}},
+                )
+                for word in re.findall(r"\S+\s*", SIM_ANSWER):
+                    self._event(
+                        "content_block_delta",
+                        {"type": "content_block_delta", "index": 0,
+                         "delta": {"type": "text_delta", "text": word}},
+                    )
+                    time.sleep(server.token_interval)
+                self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+                self._event(
+                    "message_delta",
+                    {
+                        "type": "message_delta",
+                        "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                        "usage": {"output_tokens": usage["output_tokens"]},
+                    },
+                )
+                self._event("message_stop", {"type": "message_stop"})
+                self._chunk(b"")  # end of chunked body
+
+        return Handler
@@ -0,0 +1,104 @@
+"""Burst fusion: registered and stacked frames are no worse than the sharpest one"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+os.environ["PISOLVER_BACKEND"] = "sim"
+os.environ["PISOLVER_SIM_HOLDS"] = ""
+os.environ["HOME"] = tempfile.mkdtemp(prefix="pisolver-test-")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import worksheet_capture as wc  # noqa: E402
+
+FRAME_SIZE = (1152, 648)
+SUPERSAMPLE = 4  # the scene is rendered this much finer, so shifts can be fractional
+MARGIN = 40  # frame pixels of scene around the view, room for the shifts
+WORDS = ["solve", "x", "+", "=", "find", "the", "area", "of", "42", "17", "3/4", "y", "sum"]
+
+
+def render_scene(seed, repeated=False):
+    """A page of text at SUPERSAMPLE x frame resolution, softened like a lens would"""
+    rng = np.random.default_rng(seed)
+    width, height = FRAME_SIZE
+    size = ((width + 2 * MARGIN) * SUPERSAMPLE, (height + 2 * MARGIN) * SUPERSAMPLE)
+    scene = Image.new("L", size, 235)
+    draw = ImageDraw.Draw(scene)
+    font = ImageFont.load_default(size=24 * SUPERSAMPLE)
+    for row in range(22):
+        if repeated:
+            text = "1) 12 + 7 = ____   2) 12 + 7 = ____   3) 12 + 7 = ____"
+        else:
+            text = " ".join(rng.choice(WORDS, size=12))
+        draw.text((60 * SUPERSAMPLE, (50 + row * 32) * SUPERSAMPLE), text, fill=30, font=font)
+    return np.asarray(scene.filter(ImageFilter.GaussianBlur(0.8 * SUPERSAMPLE)), dtype=np.float32)
+
+
+def view(scene, dy, dx):
+    """The frame whose pixel (y, x) sees scene point (y + dy, x + dx), box-sampled"""
+    width, height = FRAME_SIZE
+    top = round((MARGIN + dy) * SUPERSAMPLE)
+    left = round((MARGIN + dx) * SUPERSAMPLE)
+    window = scene[top:top + height * SUPERSAMPLE, left:left + width * SUPERSAMPLE]
+    return window.reshape(height, SUPERSAMPLE, width, SUPERSAMPLE).mean(axis=(1, 3))
+
+
+def burst(seed, repeated=False, count=5, noise=8.0):
+    """Noisy frames shifted by known fractional amounts; the first is the sharpest"""
+    rng = np.random.default_rng(seed)
+    scene = render_scene(seed, repeated)
+    shifts = [(0.0, 0.0)] + [tuple(rng.uniform(-12, 12, size=2)) for _ in range(count - 1)]
+    frames = []
+    for index, (dy, dx) in enumerate(shifts):
+        luma = np.clip(view(scene, dy, dx) + rng.normal(0, noise, FRAME_SIZE[::-1]), 0, 255)
+        frame = wc.Frame(
+            index=index + 1,
+            timestamp=index,
+            array=np.repeat(luma.astype(np.uint8)[..., None], 3, axis=2),
+        )
+        frame.sharpness = 1000.0 - index
+        frame.page_quad = np.zeros((4, 2), dtype=np.float32)  # tracks the fused crop offset
+        frames.append(frame)
+    return frames, view(scene, 0, 0)
+
+
+def text_error(image, truth):
+    """Mean absolute error over the pixels near text, where legibility is decided"""
+    dark = truth < 180
+    near_text = dark.copy()
+    for axis in (0, 1):
+        for step in (-2, -1, 1, 2):
+            near_text |= np.roll(dark, step, axis=axis)
+    return float(np.abs(image[..., 0].astype(np.float32) - truth)[near_text].mean())
+
+
+def fused_error(frames, truth):
+    """Text error of the fused frame, or None when fusion declined"""
+    fused = wc.fuse_frames(frames)
+    if fused is None:
+        return None
+    left, top = (-fused.page_quad[0]).round().astype(int)
+    height, width = fused.array.shape[:2]
+    return text_error(fused.array, truth[top:top + height, left:left + width])
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_fused_text_is_no_worse_than_reference(seed):
+    frames, truth = burst(seed)
+    reference_error = text_error(frames[0].array, truth)
+    error = fused_error(frames, truth)
+    assert error is not None
+    assert error <= reference_error
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_repeated_lines_never_make_it_worse(seed):
+    frames, truth = burst(seed, repeated=True)
+    reference_error = text_error(frames[0].array, truth)
+    error = fused_error(frames, truth)
+    assert error is None or error <= reference_error
@@ -0,0 +1,101 @@
+"""Response cache matching: re-shots of a worksheet hit, different worksheets miss"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+os.environ["PISOLVER_BACKEND"] = "sim"
+os.environ["PISOLVER_SIM_HOLDS"] = ""
+os.environ["HOME"] = tempfile.mkdtemp(prefix="pisolver-test-")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+pytest.importorskip("cv2")
+import cv2  # noqa: E402
+
+import worksheet_capture as wc  # noqa: E402
+
+FRAME_SIZE = (2304, 1296)
+PAGE_SIZE = (850, 1100)
+
+SHEET_A = ["Worksheet 3", "1) 12 + 7 =", "2) 42 + 17 =", "3) 9 x 6 =", "4) 81 / 9 ="]
+SHEET_B = ["Worksheet 4", "1) 15 + 8 =", "2) 36 + 29 =", "3) 7 x 8 =", "4) 72 / 8 ="]
+
+
+def render_sheet(lines, answers=()):
+    """A printed worksheet, optionally with some answers written in"""
+    page = Image.new("L", PAGE_SIZE, 245)
+    draw = ImageDraw.Draw(page)
+    font = ImageFont.load_default(size=44)
+    for row, line in enumerate(lines):
+        draw.text((80, 100 + row * 150), line, fill=30, font=font)
+    for row, answer in answers:
+        draw.text((520, 100 + row * 150), answer, fill=60, font=font)
+    return np.asarray(page)
+
+
+def photograph(sheet, seed):
+    """The sheet on a desk from a slightly different pose, with blur and sensor noise"""
+    rng = np.random.default_rng(seed)
+    page_w, page_h = PAGE_SIZE
+    corners = np.array([[0, 0], [page_w, 0], [page_w, page_h], [0, page_h]], dtype=np.float32)
+    placed = corners * 1.0 + np.array([720, 90], dtype=np.float32)
+    placed += rng.uniform(-25, 25, size=placed.shape).astype(np.float32)
+    transform = cv2.getPerspectiveTransform(corners, placed)
+    desk = np.full(FRAME_SIZE[::-1], 90, dtype=np.uint8)
+    luma = cv2.warpPerspective(
+        sheet, transform, FRAME_SIZE, dst=desk, borderMode=cv2.BORDER_TRANSPARENT
+    )
+    luma = np.asarray(Image.fromarray(luma).filter(ImageFilter.GaussianBlur(rng.uniform(0.5, 1.5))))
+    luma = np.clip(luma + rng.normal(0, 4, luma.shape) + rng.uniform(-20, 20), 0, 255)
+    rgb = np.repeat(luma.astype(np.uint8)[..., None], 3, axis=2)
+
+    frame = wc.Frame(index=0, timestamp=0, array=rgb)
+    quad = wc.detect_page(wc.rgb_to_luma(rgb[::4, ::4]))
+    assert quad is not None
+    frame.page_quad = quad * 4
+    return frame
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return wc.ResponseCache(
+        tmp_path / "cache.db",
+        max_entries=10,
+        ttl=3600,
+        max_density=wc.RESPONSE_CACHE_MAX_DENSITY,
+        max_ink=wc.RESPONSE_CACHE_MAX_INK,
+        max_compare=wc.RESPONSE_CACHE_MAX_COMPARE,
+    )
+
+
+def test_reshot_sheet_hits(cache):
+    sheet = render_sheet(SHEET_A)
+    cache.store(wc.page_key(photograph(sheet, seed=1)), "answer A")
+    for seed in range(2, 6):
+        assert cache.lookup(wc.page_key(photograph(sheet, seed=seed))) == "answer A"
+
+
+def test_different_sheet_misses(cache):
+    cache.store(wc.page_key(photograph(render_sheet(SHEET_A), seed=1)), "answer A")
+    assert cache.lookup(wc.page_key(photograph(render_sheet(SHEET_B), seed=2))) is None
+
+
+def test_written_answer_misses(cache):
+    cache.store(wc.page_key(photograph(render_sheet(SHEET_A), seed=1)), "answer A")
+    answered = render_sheet(SHEET_A, answers=[(2, "59")])
+    assert cache.lookup(wc.page_key(photograph(answered, seed=2))) is None
+
+
+def test_reshot_hits_among_same_template_sheets(cache):
+    """Only the closest few stored sheets are aligned; the right one must be among them"""
+    for seed in range(8):
+        answers = [(row, str(10 + 11 * seed + row)) for row in range(1, 5)]
+        sheet = render_sheet(SHEET_A, answers=answers)
+        cache.store(wc.page_key(photograph(sheet, seed=seed)), f"answers {seed}")
+    cache.store(wc.page_key(photograph(render_sheet(SHEET_A), seed=20)), "blank")
+    assert cache.lookup(wc.page_key(photograph(render_sheet(SHEET_A), seed=21))) == "blank"
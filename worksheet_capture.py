@@ -4,18 +4,41 @@ Worksheet Capture & AI Analysis System
 Captures burst photos on button hold, sends to Claude API
 """
 
+import argparse
+import asyncio
 import base64
+import functools
+import hashlib
+import io
+import json
 import logging
 import os
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
 import time
+import wave
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Optional
 
-import adafruit_drv2605
-import board
-import busio
-from anthropic import Anthropic
-from gpiozero import Button
-from picamera2 import Picamera2
+import numpy as np
+from PIL import Image, ImageFilter
+
+# "sim" swaps the camera, button, haptics and API for simulation.py stand-ins
+BACKEND = os.environ.get("PISOLVER_BACKEND", "hardware")
+
+# Hardware libraries, OpenCV and anthropic are slow to import (or absent off
+# the Pi); their components import them on first use (see INITIALIZATION)
+if BACKEND == "sim":
+    from simulation import MockAnthropicServer, SimButton, SimCamera, SimHaptics
 
 # =====================================================
 # CONFIGURATION
@@ -23,7 +46,84 @@ from picamera2 import Picamera2
 BUTTON_PIN = 27
 CAPTURE_DIR = Path.home() / "worksheet_capture" / "images"
 BURST_DELAY = 0.20  # seconds between captures
+ADAPTIVE_BURST = True  # capture faster while frames are poor, stop once enough are good
+BURST_MIN_DELAY = 0.05  # seconds between captures while frames are blurry or moving
+BURST_MIN_FRAMES = 4  # frames after the press before the burst may stop early
+BURST_SHARP_RATIO = 0.8  # fraction of the sharpest frame's sharpness that counts as sharp
+BURST_MOTION_DISTANCE = 6  # dHash bits changed between frames that count as movement
+BURST_MIN_SHARPNESS = 300.0  # sharpness below which a frame never ends a burst (sensor noise)
+BURST_BASELINE_RATIO = 0.5  # ...nor below this fraction of recent bursts' median best sharpness
+BURST_BASELINE_BURSTS = 8  # recent bursts that median is taken over
+BURST_HURRY_RESERVE = 8  # frame pool slots left for normal pacing once hurrying has used the rest
+CAPTURE_SIZE = (2304, 1296)
+LORES_SIZE = (576, 324)  # greyscale scoring stream, 1/16 of the pixels (None = off)
+CAPTURE_MODE = "memory"  # "memory" keeps frames in RAM, "file" writes each JPEG to disk
+FRAME_POOL_SIZE = 16  # preallocated full-resolution frames (~9 MB each)
+JPEG_QUALITY = 90
+JPEG_MIN_QUALITY = 60  # floor when shrinking an image to fit UPLOAD_MAX_BYTES
+UPLOAD_MAX_BYTES = 350_000  # per-image JPEG budget
+API_MAX_EDGE = 1568  # the API downscales anything with a longer edge
+API_MAX_PIXELS = 1_150_000  # ...or more pixels than this
+ENCODE_WORKERS = 2  # background encode/persist threads (0 = inline, serial)
+ENCODE_QUEUE_SIZE = 4  # frames waiting for a worker before capture blocks
+PERSIST_FRAMES = True  # write every encoded frame to CAPTURE_DIR
+UPLOAD_TOP_K = 3  # sharpest frames sent to the API (0 = send all)
+SCORE_DOWNSAMPLE = 4  # luma decimation used for on-device scoring
+DEDUP_MAX_DISTANCE = 6  # dHash Hamming distance treated as a duplicate (None = off)
+AUTOFOCUS_MODE = "continuous"  # "continuous" tracks between bursts, "once" per burst
+FUSE_FRAMES = True  # stack the best frames into one denoised image
+FUSE_MAX_FRAMES = 5
+FUSE_METHOD = "median"  # "median" rejects moving hands, "mean" denoises most
+FUSE_MIN_SHARPNESS = 0.8  # fraction of the reference frame's sharpness to stack
+FUSE_MAX_SHIFT = 0.05  # largest registration shift accepted, as a fraction of width
+FUSE_MIN_CORRELATION = 0.1  # phase-correlation peak below which frames don't match
+FUSE_MAX_PEAK_RATIO = 0.5  # runner-up peak above this fraction of the best: ambiguous, skipped
+FUSE_REFINE_SIZE = 384  # central full-resolution patch each shift is refined on (pixels square)
+FUSE_MIN_MATCH = 0.5  # normalised correlation of the refined patches below which frames don't match
+PAGE_CROP = True  # warp the detected worksheet to a flat rectangle (needs OpenCV)
+PAGE_MIN_AREA = 0.15  # smallest page quad accepted, as a fraction of the frame
+PRETRIGGER_FRAMES = 3  # frames kept from before the press (0 = off, memory mode only)
+TRACE_LOG = Path.home() / "worksheet_capture" / "traces.jsonl"  # one session per line
 API_KEY = os.environ.get("ANTHROPIC_API_KEY")
+MODEL = "claude-sonnet-4-20250514"
+MAX_TOKENS = 1024
+STREAM_RESPONSES = True  # print the answer as it is generated
+API_TIMEOUT = 60.0  # seconds for a whole request
+API_CONNECT_TIMEOUT = 5.0
+API_MAX_CONNECTIONS = 4
+API_KEEPALIVE_CONNECTIONS = 2  # idle connections kept open in the pool
+API_KEEPALIVE_EXPIRY = 120.0  # seconds an idle pooled connection survives client-side
+API_KEEPALIVE_INTERVAL = 30.0  # seconds between pings that keep the connection hot (0 = off)
+MAX_PENDING_ANALYSES = 2  # bursts that may wait on the API before capture blocks
+JOB_DB_PATH = Path.home() / "worksheet_capture" / "jobs.sqlite3"
+JOB_MAX_ATTEMPTS = 6
+JOB_KEEP_FAILED = 10  # most recent failed jobs kept for inspection, older ones purged
+RETRY_BASE_DELAY = 2.0  # seconds, doubled per attempt, with jitter
+RETRY_MAX_DELAY = 60.0
+API_CONCURRENCY = 2  # simultaneous API requests
+SPECULATIVE_UPLOAD = False  # upload top frames via the Files API while the button is held
+FILES_API_BETA = "files-api-2025-04-14"
+RESPONSE_CACHE_PATH = Path.home() / "worksheet_capture" / "responses.sqlite3"
+RESPONSE_CACHE_MAX_ENTRIES = 200  # least recently used answers evicted beyond this (0 = off)
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # seconds
+RESPONSE_CACHE_INK_SIZE = (384, 512)  # (w, h) the cropped page's writing is compared at
+RESPONSE_CACHE_INK_TILE = 16  # writing is compared tile by tile, in pixels at that size
+RESPONSE_CACHE_MAX_DENSITY = 0.2  # ink-fraction change in any 2x2-tile cell to compare a sheet
+RESPONSE_CACHE_MAX_INK = 12  # unmatched ink pixels in any tile still treated as the same worksheet
+RESPONSE_CACHE_MAX_COMPARE = 4  # closest stored sheets by ink density aligned per lookup
+TTS_ENGINE = "espeak"  # "espeak" (espeak-ng), "piper", or None to stay silent
+TTS_VOICE = "en-us"  # espeak voice name, or path to a piper .onnx model
+TTS_RATE = 165  # words per minute (espeak); piper uses the model's own rate
+PIPER_SAMPLE_RATE = 22050
+TTS_CACHE_DIR = Path.home() / "worksheet_capture" / "tts_cache"
+TTS_CACHE_MAX_BYTES = 64 * 1024 * 1024  # LRU-evicted beyond this (0 = no cache)
+SIM_IMAGE_DIR = os.environ.get("PISOLVER_SIM_IMAGES")  # replayed frames (None = synthetic page)
+SIM_FPS = float(os.environ.get("PISOLVER_SIM_FPS", "30"))
+SIM_HOLDS = [  # scripted button hold durations in seconds
+    float(hold) for hold in os.environ.get("PISOLVER_SIM_HOLDS", "2.0").split(",") if hold
+]
+SIM_API_URL = os.environ.get("PISOLVER_API_URL")  # None = start the local mock API
+SIM_API_LATENCY = float(os.environ.get("PISOLVER_SIM_API_LATENCY", "0.8"))  # time to first token
 
 # =====================================================
 # LOGGING
@@ -35,143 +135,1715 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # =====================================================
-# INITIALIZATION
+# INITIALIZATION
+# =====================================================
+def process_uptime():
+    """Seconds since this process started (Linux), or None"""
+    try:
+        stat = Path("/proc/self/stat").read_text()
+        started = int(stat.rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - started
+
+
+class ComponentRegistry:
+    """Hardware and API components, each brought up once on first use
+
+    get() initializes a component (or waits for its initialization already
+    in progress); start() initializes several concurrently in the background.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._locks = {}
+        self.timings = {}  # seconds each component took to initialize
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+        self._locks[name] = threading.Lock()
+
+    def get(self, name, wait=True):
+        """The component, initializing it if needed
+
+        With wait=False, returns None instead of blocking while it is not ready.
+        """
+        if name in self._instances:
+            return self._instances[name]
+        lock = self._locks[name]
+        if not lock.acquire(blocking=wait):
+            return None
+        try:
+            if name not in self._instances:
+                if not wait:
+                    return None
+                start = time.monotonic()
+                self._instances[name] = self._factories[name]()
+                self.timings[name] = time.monotonic() - start
+            return self._instances[name]
+        finally:
+            lock.release()
+
+    def start(self, names):
+        """Initialize components concurrently; returns the threads doing it"""
+        threads = [
+            threading.Thread(target=self._start_one, args=(name,), name=f"init-{name}", daemon=True)
+            for name in names
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _start_one(self, name):
+        try:
+            self.get(name)
+        except Exception as exc:
+            logger.error(f"Initializing {name} failed: {exc}")
+
+    def report(self):
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items())
+
+
+components = ComponentRegistry()
+
+
+def init_button():
+    if BACKEND == "sim":
+        button = SimButton(SIM_HOLDS)
+        logger.info(f"Simulated button initialized ({len(SIM_HOLDS)} scripted presses)")
+    else:
+        from gpiozero import Button
+
+        button = Button(BUTTON_PIN, pull_up=True, bounce_time=0.1)
+        logger.info(f"Button initialized on GPIO {BUTTON_PIN}")
+    return button
+
+
+def init_haptics():
+    """The haptic driver, or None when it is not connected"""
+    if BACKEND == "sim":
+        logger.info("Simulated haptics initialized")
+        return SimHaptics()
+    try:
+        import adafruit_drv2605
+        import board
+        import busio
+
+        drv = adafruit_drv2605.DRV2605(busio.I2C(board.SCL, board.SDA))
+        logger.info("Haptics initialized")
+        return drv
+    except Exception as exc:
+        logger.warning(f"Haptics unavailable: {exc}")
+        return None
+
+
+def camera_controls():
+    """libcamera's control enums, or the simulated ones"""
+    if BACKEND == "sim":
+        from simulation import controls
+    else:
+        from libcamera import controls
+    return controls
+
+
+def init_camera():
+    if BACKEND == "sim":
+        picam = SimCamera(SIM_IMAGE_DIR, fps=SIM_FPS)
+    else:
+        from picamera2 import Picamera2
+
+        picam = Picamera2()
+    config = picam.create_still_configuration(
+        main={"size": CAPTURE_SIZE, "format": "BGR888"},  # BGR888 arrays are RGB ordered
+        lores={"size": LORES_SIZE, "format": "YUV420"} if LORES_SIZE else None,
+        buffer_count=4,
+    )
+    picam.configure(config)
+    picam.start()
+    if AUTOFOCUS_MODE == "continuous":
+        picam.set_controls({"AfMode": camera_controls().AfModeEnum.Continuous})
+    logger.info(f"Camera initialized ({AUTOFOCUS_MODE} autofocus)")
+    return picam
+
+
+def init_opencv():
+    """The cv2 module, or None when OpenCV is not installed"""
+    try:
+        import cv2
+    except ImportError:
+        if PAGE_CROP:
+            logger.warning("OpenCV unavailable, page cropping disabled")
+        return None
+    return cv2
+
+
+def init_capture_dir():
+    CAPTURE_DIR.mkdir(parents=True, exist_ok=True)
+    return CAPTURE_DIR
+
+
+def init_mock_api():
+    return MockAnthropicServer(first_token_latency=SIM_API_LATENCY).start()
+
+
+def init_api_client():
+    import httpx
+    from anthropic import Anthropic, DefaultHttpxClient
+
+    base_url = None
+    api_key = API_KEY
+    if BACKEND == "sim":
+        base_url = SIM_API_URL or components.get("mock_api").base_url
+        api_key = api_key or "sim-key"
+
+    client = Anthropic(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=httpx.Timeout(API_TIMEOUT, connect=API_CONNECT_TIMEOUT),
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=API_MAX_CONNECTIONS,
+                max_keepalive_connections=API_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=API_KEEPALIVE_EXPIRY,
+            ),
+        ),
+    )
+    logger.info(f"Claude API client initialized ({client.base_url})")
+    return client
+
+
+components.register("opencv", init_opencv)
+components.register("capture_dir", init_capture_dir)
+components.register("button", init_button)
+components.register("haptics", init_haptics)
+components.register("camera", init_camera)
+components.register("mock_api", init_mock_api)
+components.register("api", init_api_client)
+
+# Voice output
+TTS_COMMANDS = {"espeak": "espeak-ng", "piper": "piper"}
+tts_command = TTS_COMMANDS.get(TTS_ENGINE)
+TTS_ENABLED = bool(tts_command and shutil.which(tts_command) and shutil.which("aplay"))
+if TTS_ENABLED:
+    logger.info(f"Voice output initialized ({TTS_ENGINE})")
+elif TTS_ENGINE:
+    logger.warning(f"Voice output unavailable: {TTS_ENGINE} or aplay not found")
+
+# =====================================================
+# HAPTIC FEEDBACK
+# =====================================================
+
+HAPTIC_PATTERNS = {  # name: (DRV2605 library effects, seconds to let it play before stopping)
+    "click": ([11, 0], 0.0),
+    "double_click": ([11, 11, 0], 0.25),
+    "burst_done": ([14, 0], 0.0),
+}
+
+
+class HapticWorker:
+    """Plays haptic patterns on a dedicated thread so callers never wait on I2C
+
+    A pattern requested while the same one is still queued is coalesced into
+    it. Each pattern's effects are built once, and the driver's sequence
+    slots are only rewritten when a different pattern was loaded last.
+    """
+
+    def __init__(self, patterns):
+        self._patterns = patterns
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.coalesced = 0  # requests folded into a queued one; capture_burst logs them
+
+    def play(self, name):
+        """Queue a pattern; returns immediately"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="haptics", daemon=True)
+                self._thread.start()
+            if name in self._pending:
+                self.coalesced += 1
+                return
+            self._pending.add(name)
+        self._queue.put(name)
+
+    def _waveforms(self):
+        """Each pattern's effects, built once for the driver in use"""
+        if BACKEND == "sim":
+            effect_type = SimHaptics.Effect
+        else:
+            from adafruit_drv2605 import Effect as effect_type
+        return {
+            name: ([effect_type(effect) for effect in effects], pause_after)
+            for name, (effects, pause_after) in self._patterns.items()
+        }
+
+    def _run(self):
+        drv = waveforms = loaded = None
+        while True:
+            name = self._queue.get()
+            with self._lock:
+                self._pending.discard(name)
+            if waveforms is None:
+                drv = components.get("haptics")  # waits here, not in the caller
+                waveforms = self._waveforms() if drv is not None else {}
+            if drv is None:
+                continue
+
+            effects, pause_after = waveforms[name]
+            try:
+                if name != loaded:
+                    loaded = None  # a failed write leaves the slots unknown
+                    for idx, effect in enumerate(effects):
+                        drv.sequence[idx] = effect
+                    loaded = name
+                drv.play()
+                if pause_after:
+                    time.sleep(pause_after)
+                    drv.stop()
+            except Exception as exc:
+                logger.debug(f"Haptic {name} failed: {exc}")
+
+
+haptics = HapticWorker(HAPTIC_PATTERNS)
+
+
+def haptic_click():
+    """Single click - capture feedback"""
+    haptics.play("click")
+
+
+def haptic_double_click():
+    """Double click - API response received"""
+    haptics.play("double_click")
+
+
+def haptic_burst_done():
+    """Buzz - burst stopped early, enough good frames"""
+    haptics.play("burst_done")
+
+# =====================================================
+# LATENCY TRACING
+# =====================================================
+
+class Trace:
+    """Timed spans for one session, from button press to spoken answer
+
+    Offsets are seconds since the press. Marks are spans of zero duration.
+    """
+
+    def __init__(self, origin=None):
+        self.started = time.time()
+        self._origin = origin if origin is not None else time.monotonic()
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def add(self, name, start, end):
+        with self._lock:
+            self.spans.append(
+                {"name": name, "start": start - self._origin, "duration": end - start}
+            )
+
+    def mark(self, name):
+        now = time.monotonic()
+        self.add(name, now, now)
+
+    @contextmanager
+    def span(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.monotonic())
+
+    def save(self):
+        """Append this session to TRACE_LOG"""
+        self.mark("done")
+        try:
+            with open(TRACE_LOG, "a") as file_handle:
+                file_handle.write(json.dumps({"started": self.started, "spans": self.spans}) + "\n")
+        except OSError as exc:
+            logger.warning(f"Writing trace failed: {exc}")
+
+
+# The capture phase (press through request building) never overlaps between
+# bursts, so its stages record into this; API and playback get traces passed in.
+current_trace = None
+
+
+def start_trace(origin=None):
+    global current_trace
+    current_trace = Trace(origin)
+    return current_trace
+
+
+@contextmanager
+def trace_span(name):
+    """Record a span on the current capture session, if any"""
+    trace = current_trace
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def trace_mark(name):
+    if current_trace is not None:
+        current_trace.mark(name)
+
+
+def latency_report(last_n=20):
+    """Per-stage latency percentiles over the last N sessions in TRACE_LOG
+
+    Repeated spans (one per frame) are summed per session; marks report
+    their offset from the press.
+    """
+    try:
+        lines = TRACE_LOG.read_text().splitlines()[-last_n:]
+    except OSError:
+        return "No traces recorded yet"
+
+    per_stage = {}
+    for line in lines:
+        totals = {}
+        for span in json.loads(line)["spans"]:
+            value = span["duration"] or span["start"]
+            totals[span["name"]] = totals.get(span["name"], 0.0) + value
+        for name, value in totals.items():
+            per_stage.setdefault(name, []).append(value * 1000)
+
+    rows = [f"Latency over last {len(lines)} sessions (ms)"]
+    rows.append(f"{'stage':<18}{'n':>5}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name, values in sorted(per_stage.items(), key=lambda item: np.median(item[1])):
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        rows.append(
+            f"{name:<18}{len(values):>5}{p50:>10.0f}{p90:>10.0f}{p99:>10.0f}{max(values):>10.0f}"
+        )
+    return "\n".join(rows)
+
+# =====================================================
+# FRAME POOL
+# =====================================================
+
+@dataclass
+class Frame:
+    """A single burst frame, held in memory or on disk"""
+    index: int
+    timestamp: int
+    array: Optional[np.ndarray] = None
+    lores: Optional[np.ndarray] = None  # Y plane of the lores stream
+    path: Optional[Path] = None
+    jpeg: Optional[bytes] = None
+    sharpness: float = 0.0
+    dhash: Optional[int] = None
+    pretrigger: bool = False
+    page_quad: Optional[np.ndarray] = None  # page corners in main-stream pixels
+    source_size: Optional[tuple] = None  # (w, h) before resizing for upload
+    upload_size: Optional[tuple] = None  # (w, h) actually sent
+    upload_quality: Optional[int] = None
+    duplicates: list = field(default_factory=list)  # near-identical frames dropped for this one
+    af_state: Optional[int] = None
+    lens_position: Optional[float] = None
+
+
+def allocate_frames(size, resolution, lores_resolution):
+    """Preallocate main (RGB) and optional lores (grey) buffers"""
+    width, height = resolution
+    buffers = np.empty((size, height, width, 3), dtype=np.uint8)
+    lores = None
+    if lores_resolution:
+        lores_width, lores_height = lores_resolution
+        lores = np.empty((size, lores_height, lores_width), dtype=np.uint8)
+    return buffers, lores
+
+
+def copy_request(request, buffer, lores_buffer):
+    """Copy a completed request's main (and lores luma) images into buffers"""
+    np.copyto(buffer, request.make_array("main"))
+    if lores_buffer is not None:
+        # YUV420 arrives as one (h * 3 / 2, w) plane; the first h rows are Y
+        np.copyto(lores_buffer, request.make_array("lores")[: lores_buffer.shape[0]])
+
+
+class FramePool:
+    """Preallocated frame buffers reused across bursts"""
+
+    def __init__(self, size, resolution, lores_resolution=None):
+        self._buffers, self._lores = allocate_frames(size, resolution, lores_resolution)
+        self._next = 0
+
+    def reset(self):
+        self._next = 0
+
+    def release_last(self):
+        """Hand back the most recently acquired buffer"""
+        self._next = max(0, self._next - 1)
+
+    def free(self):
+        """Buffers left before the pool is exhausted"""
+        return len(self._buffers) - self._next
+
+    def acquire(self):
+        """Return the next free (main, lores) pair, or None if the pool is exhausted"""
+        if self._next >= len(self._buffers):
+            return None
+        slot = self._next
+        self._next += 1
+        return self._buffers[slot], self._lores[slot] if self._lores is not None else None
+
+
+frame_pool = (
+    FramePool(FRAME_POOL_SIZE, CAPTURE_SIZE, LORES_SIZE) if CAPTURE_MODE == "memory" else None
+)
+
+# =====================================================
+# FRAME PIPELINE
+# =====================================================
+
+def encode_frame(frame):
+    """JPEG-encode and persist a frame once; returns the JPEG bytes"""
+    if frame.jpeg is not None:
+        return frame.jpeg
+
+    with trace_span("encode"):
+        if frame.array is not None:
+            image = Image.fromarray(crop_page(frame))
+        else:
+            image = Image.open(frame.path)
+            image.draft("RGB", api_image_size(*image.size))  # decode at reduced scale
+
+        frame.source_size = image.size
+        frame.jpeg, frame.upload_quality, frame.upload_size = encode_for_upload(image)
+        if PERSIST_FRAMES and frame.array is not None:
+            frame.path = components.get("capture_dir") / f"{frame.timestamp}.jpg"
+            frame.path.write_bytes(frame.jpeg)
+    return frame.jpeg
+
+
+def process_frame(frame):
+    """Score a captured frame; without a lores image, also encode it now"""
+    if not frame.pretrigger:
+        haptic_click()  # Shutter click feedback
+
+    # With lores, the full-resolution frame is only encoded if it gets sent.
+    # Without it, file frames are scored from their JPEG, so encode those first;
+    # in-memory frames wait for the page to be found so the crop applies.
+    if frame.lores is None and frame.array is None:
+        encode_frame(frame)
+
+    with trace_span("score"):
+        luma = frame_luma(frame)
+        frame.sharpness = sharpness_score(luma)
+        frame.dhash = difference_hash(luma)
+        if PAGE_CROP and frame.array is not None and components.get("opencv") is not None:
+            quad = detect_page(luma)
+            if quad is not None:
+                frame.page_quad = quad * (frame.array.shape[1] / luma.shape[1])
+
+    if frame.lores is None and frame.array is not None:
+        encode_frame(frame)
+    if speculative_uploader:
+        speculative_uploader.consider(frame)
+    if burst_scheduler:
+        burst_scheduler.observe(frame)
+    logger.info(
+        f"Captured: frame {frame.index} "
+        f"(sharpness {frame.sharpness:.1f}, lens {frame.lens_position})"
+    )
+
+
+class FramePipeline:
+    """Bounded worker pool that processes frames off the capture loop
+
+    The workers are started with the first frame submitted.
+    """
+
+    def __init__(self, workers, queue_size):
+        self._workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._started = False
+        self._lock = threading.Lock()
+
+    def submit(self, frame):
+        """Queue a frame, blocking while the queue is full (backpressure)"""
+        if not self._workers:
+            self._process(frame)
+            return
+        with self._lock:
+            if not self._started:
+                for n in range(self._workers):
+                    threading.Thread(
+                        target=self._run, name=f"frame-worker-{n}", daemon=True
+                    ).start()
+                self._started = True
+        self._queue.put(frame)
+
+    def join(self):
+        """Wait until every submitted frame has been processed"""
+        self._queue.join()
+
+    def _process(self, frame):
+        try:
+            process_frame(frame)
+        except Exception as exc:
+            logger.error(f"Processing frame {frame.index} failed: {exc}")
+            if burst_scheduler:
+                burst_scheduler.skip(frame)
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            try:
+                self._process(frame)
+            finally:
+                self._queue.task_done()
+
+
+frame_pipeline = FramePipeline(ENCODE_WORKERS, ENCODE_QUEUE_SIZE)
+
+# =====================================================
+# CAMERA FUNCTIONS
+# =====================================================
+
+def autofocus_once():
+    """Perform autofocus"""
+    try:
+        components.get("camera").autofocus_cycle()
+        time.sleep(0.2)
+        logger.debug("Autofocus complete")
+    except Exception:
+        pass
+
+
+def is_refocusing(af_state):
+    """True while the lens is still scanning for focus"""
+    return af_state == camera_controls().AfStateEnum.Scanning
+
+
+def capture_to_memory(index, timestamp):
+    """Copy the next main-stream frame into a pool buffer (no encode, no disk)"""
+    buffers = frame_pool.acquire()
+    if buffers is None:
+        return None
+    buffer, lores_buffer = buffers
+
+    request = components.get("camera").capture_request()
+    try:
+        copy_request(request, buffer, lores_buffer)
+        metadata = request.get_metadata()
+    finally:
+        request.release()
+
+    return Frame(
+        index=index,
+        timestamp=timestamp,
+        array=buffer,
+        lores=lores_buffer,
+        af_state=metadata.get("AfState"),
+        lens_position=metadata.get("LensPosition"),
+    )
+
+
+def capture_to_file(index, timestamp):
+    """Capture the next frame straight to a JPEG on disk"""
+    filepath = components.get("capture_dir") / f"{timestamp}.jpg"
+    metadata = components.get("camera").capture_file(str(filepath)) or {}
+    return Frame(
+        index=index,
+        timestamp=timestamp,
+        path=filepath,
+        af_state=metadata.get("AfState"),
+        lens_position=metadata.get("LensPosition"),
+    )
+
+
+def discard_frame(frame):
+    """Give back the resources of a frame that will not be kept"""
+    if frame.array is not None:
+        frame_pool.release_last()
+    elif frame.path is not None:
+        frame.path.unlink(missing_ok=True)
+
+
+class PreTriggerRing:
+    """Rolling buffer of the most recent frames, filled while idle"""
+
+    def __init__(self, size, resolution, lores_resolution, interval):
+        self._buffers, self._lores = allocate_frames(size, resolution, lores_resolution)
+        self._timestamps = [None] * size
+        self._metadata = [{}] * size
+        self._interval = interval
+        self._count = 0
+        self._lock = threading.Lock()
+        self._filling = threading.Event()
+        threading.Thread(target=self._run, name="pretrigger", daemon=True).start()
+
+    def resume(self):
+        """Start refilling the ring from an empty state"""
+        with self._lock:
+            self._timestamps = [None] * len(self._buffers)
+            self._count = 0
+        self._filling.set()
+
+    def drain(self):
+        """Stop filling and return (timestamp, metadata, buffer, lores), oldest first
+
+        Buffers are only valid until the next resume().
+        """
+        self._filling.clear()
+        with self._lock:  # waits out a capture in flight
+            size = len(self._buffers)
+            slots = [(self._count + offset) % size for offset in range(size)]
+            return [
+                (
+                    self._timestamps[slot],
+                    self._metadata[slot],
+                    self._buffers[slot],
+                    self._lores[slot] if self._lores is not None else None,
+                )
+                for slot in slots
+                if self._timestamps[slot] is not None
+            ]
+
+    def _run(self):
+        while True:
+            self._filling.wait()
+            try:
+                with self._lock:
+                    if not self._filling.is_set():
+                        continue
+                    slot = self._count % len(self._buffers)
+                    request = components.get("camera").capture_request()
+                    try:
+                        metadata = request.get_metadata()
+                        if not is_refocusing(metadata.get("AfState")):
+                            copy_request(
+                                request,
+                                self._buffers[slot],
+                                self._lores[slot] if self._lores is not None else None,
+                            )
+                    finally:
+                        request.release()
+                    if not is_refocusing(metadata.get("AfState")):
+                        self._timestamps[slot] = int(time.time() * 1000)
+                        self._metadata[slot] = metadata
+                        self._count += 1
+            except Exception as exc:
+                logger.error(f"Pre-trigger capture failed: {exc}")
+            time.sleep(self._interval)
+
+
+def init_pretrigger():
+    """The pre-trigger ring, filling once the camera is up, or None when off"""
+    if CAPTURE_MODE != "memory" or not PRETRIGGER_FRAMES:
+        return None
+    components.get("camera")
+    pretrigger = PreTriggerRing(PRETRIGGER_FRAMES, CAPTURE_SIZE, LORES_SIZE, BURST_DELAY)
+    pretrigger.resume()
+    return pretrigger
+
+
+components.register("pretrigger", init_pretrigger)
+
+
+def take_pretrigger_frames(pretrigger):
+    """Move the ring's frames into the frame pool as the start of the burst"""
+    frames = []
+    for timestamp, metadata, buffer, lores in pretrigger.drain():
+        buffers = frame_pool.acquire()
+        if buffers is None:
+            break
+        slot, lores_slot = buffers
+        np.copyto(slot, buffer)
+        if lores_slot is not None:
+            np.copyto(lores_slot, lores)
+        frames.append(
+            Frame(
+                index=len(frames) + 1,
+                timestamp=timestamp,
+                array=slot,
+                lores=lores_slot,
+                pretrigger=True,
+                af_state=metadata.get("AfState"),
+                lens_position=metadata.get("LensPosition"),
+            )
+        )
+    return frames
+
+
+class BurstScheduler:
+    """Paces a burst by the frames scored so far and decides when it can stop
+
+    While the latest frame is blurry (well below the sharpest so far) or the
+    scene moved since the previous one, frames are taken every BURST_MIN_DELAY
+    instead of BURST_DELAY, until only BURST_HURRY_RESERVE pool slots are left.
+    Only live frames that held still and clear a sharpness floor (absolute,
+    and relative to recent bursts) count towards stopping. Scores arrive from
+    the pipeline workers a frame or two behind capture and not necessarily in
+    order, so each frame is held until its predecessor has been seen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recent_best = deque(maxlen=BURST_BASELINE_BURSTS)
+        self._frames = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            if self._frames:
+                self._recent_best.append(max(frame.sharpness for frame in self._frames))
+            self._frames = []
+            self._moving = set()  # indices of frames that moved since the one before
+            self._previous_hash = None
+            self._hurry = False
+            self._held = {}  # frames waiting for their predecessor by index (None = skipped)
+            self._next_index = 1
+
+    def _sharpness_floor(self):
+        floor = BURST_MIN_SHARPNESS
+        if self._recent_best:
+            floor = max(floor, BURST_BASELINE_RATIO * float(np.median(self._recent_best)))
+        return floor
+
+    def observe(self, frame):
+        """Record a scored frame"""
+        with self._lock:
+            self._hold(frame.index, frame)
+
+    def skip(self, frame):
+        """Stop waiting for a frame that will never be scored"""
+        with self._lock:
+            self._hold(frame.index, None)
+
+    def _hold(self, index, frame):
+        if index < self._next_index:
+            return
+        self._held[index] = frame
+        while self._next_index in self._held:
+            frame = self._held.pop(self._next_index)
+            self._next_index += 1
+            if frame is not None:
+                self._take(frame)
+
+    def _take(self, frame):
+        """Take the next frame in capture order"""
+        moving = (
+            frame.dhash is not None
+            and self._previous_hash is not None
+            and (frame.dhash ^ self._previous_hash).bit_count() > BURST_MOTION_DISTANCE
+        )
+        if moving:
+            self._moving.add(frame.index)
+        self._previous_hash = frame.dhash
+        self._frames.append(frame)
+        best = max(scored.sharpness for scored in self._frames)
+        sharp_enough = max(BURST_SHARP_RATIO * best, self._sharpness_floor())
+        self._hurry = moving or frame.sharpness < sharp_enough
+
+    def next_interval(self, free_slots=None):
+        """Seconds until the next capture, given the frame pool slots left (None = unbounded)"""
+        if self._hurry and (free_slots is None or free_slots > BURST_HURRY_RESERVE):
+            return BURST_MIN_DELAY
+        return BURST_DELAY
+
+    def stop_reason(self, live_frames):
+        """Why the burst already has enough good frames, or None to keep going"""
+        if live_frames < BURST_MIN_FRAMES:
+            return None
+        with self._lock:
+            floor = self._sharpness_floor()
+            scored = [
+                frame for frame in self._frames
+                if frame.dhash is not None
+                and not frame.pretrigger
+                and frame.index not in self._moving
+                and frame.sharpness >= floor
+            ]
+        if not scored:
+            return None
+
+        best = max(scored, key=lambda frame: frame.sharpness)
+        sharp = [frame for frame in scored if frame.sharpness >= BURST_SHARP_RATIO * best.sharpness]
+
+        # Fusion wants sharp views of the same scene as the sharpest frame
+        if FUSE_FRAMES and not SPECULATIVE_UPLOAD:
+            stack = [
+                frame for frame in sharp
+                if (frame.dhash ^ best.dhash).bit_count() <= BURST_MOTION_DISTANCE
+            ]
+            if len(stack) >= FUSE_MAX_FRAMES:
+                return f"{len(stack)} sharp matching frames to fuse"
+
+        # Selection wants sharp frames that differ from each other
+        distinct = []
+        for frame in sorted(sharp, key=lambda frame: frame.sharpness, reverse=True):
+            if all(
+                (frame.dhash ^ other.dhash).bit_count() > BURST_MOTION_DISTANCE
+                for other in distinct
+            ):
+                distinct.append(frame)
+        if UPLOAD_TOP_K and len(distinct) >= UPLOAD_TOP_K:
+            return f"{len(distinct)} distinct sharp frames"
+        return None
+
+
+burst_scheduler = BurstScheduler() if ADAPTIVE_BURST else None
+
+
+def capture_burst(pressed_at=None):
+    """Capture images while button is held, or until enough good frames exist
+
+    pressed_at (time.monotonic()) anchors the session trace; defaults to now.
+    """
+    start_trace(pressed_at)
+    logger.info("=== BURST STARTED ===")
+    frames = []
+    capture = capture_to_memory if CAPTURE_MODE == "memory" else capture_to_file
+    button = components.get("button")
+    pretrigger = components.get("pretrigger", wait=False)  # still starting: no pre-trigger
+    if frame_pool:
+        frame_pool.reset()
+    if speculative_uploader:
+        speculative_uploader.reset()
+    if burst_scheduler:
+        burst_scheduler.reset()
+
+    # Frames from just before the press are available immediately
+    if pretrigger:
+        frames = take_pretrigger_frames(pretrigger)
+        for frame in frames:
+            frame_pipeline.submit(frame)
+        if frames:
+            trace_mark("first_frame")
+        logger.info(f"Recovered {len(frames)} pre-trigger frames")
+
+    # Continuous AF is already tracking; otherwise focus once at start
+    if AUTOFOCUS_MODE != "continuous":
+        with trace_span("autofocus"):
+            autofocus_once()
+    refocus_dropped = 0
+    coalesced_before = haptics.coalesced
+    pretrigger_count = len(frames)
+    stop_reason = "button released"
+
+    # Capture while button held; encoding and feedback run on the pipeline
+    burst_start = time.monotonic()
+    while button.is_pressed:
+        try:
+            frame_start = time.monotonic()
+            timestamp = int(time.time() * 1000)
+            with trace_span("capture"):
+                frame = capture(len(frames) + 1, timestamp)
+            if frame is None:
+                logger.warning("Frame pool exhausted, ignoring rest of burst")
+                stop_reason = "frame pool exhausted"
+                button.wait_for_release()
+                break
+            if is_refocusing(frame.af_state):
+                discard_frame(frame)
+                refocus_dropped += 1
+                continue
+            if not frames:
+                trace_mark("first_frame")
+            frames.append(frame)
+            frame_pipeline.submit(frame)
+
+            interval = BURST_DELAY
+            if burst_scheduler:
+                reason = burst_scheduler.stop_reason(len(frames) - pretrigger_count)
+                if reason:
+                    stop_reason = reason
+                    trace_mark("early_stop")
+                    haptic_burst_done()  # the user can let go
+                    break
+                interval = burst_scheduler.next_interval(
+                    frame_pool.free() if frame_pool else None
+                )
+            time.sleep(max(0.0, interval - (time.monotonic() - frame_start)))
+
+        except Exception as exc:
+            logger.error(f"Capture failed: {exc}")
+
+    burst_time = time.monotonic() - burst_start
+    trace_mark("release")
+    with trace_span("pipeline_drain"):
+        frame_pipeline.join()
+    if pretrigger:
+        pretrigger.resume()
+    live_frames = sum(1 for frame in frames if not frame.pretrigger)
+    fps = live_frames / burst_time if burst_time > 0 else 0.0
+    logger.info(
+        f"=== BURST ENDED: {len(frames)} images in {burst_time:.2f}s ({fps:.1f} fps), "
+        f"stopped on {stop_reason} ==="
+    )
+
+    if refocus_dropped:
+        logger.info(f"Discarded {refocus_dropped} frames captured mid-refocus")
+    coalesced = haptics.coalesced - coalesced_before
+    if coalesced:
+        logger.info(f"Coalesced {coalesced} haptic patterns requested while already queued")
+
+    frames, dropped = drop_duplicates(frames)
+    if dropped:
+        logger.info(f"Dropped {dropped} near-duplicate frames, {len(frames)} kept")
+    return frames
+
+# =====================================================
+# IMAGE PROCESSING
+# =====================================================
+
+def encode_jpeg(image, quality=JPEG_QUALITY):
+    """Encode a PIL image to JPEG bytes in memory"""
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def api_image_size(width, height):
+    """Largest size the API will use as-is (it downscales anything bigger)"""
+    scale = min(
+        1.0,
+        API_MAX_EDGE / max(width, height),
+        (API_MAX_PIXELS / (width * height)) ** 0.5,
+    )
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def estimate_image_tokens(width, height):
+    """Approximate input tokens the API charges for an image"""
+    width, height = api_image_size(width, height)
+    return (width * height + 749) // 750
+
+
+def encode_for_upload(image, max_bytes=UPLOAD_MAX_BYTES):
+    """Resize to the API's working size and encode within the byte budget
+
+    Uses JPEG_QUALITY when it fits, otherwise the highest quality down to
+    JPEG_MIN_QUALITY that does. Returns (jpeg bytes, quality, (w, h)).
+    """
+    size = api_image_size(*image.size)
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    best = encode_jpeg(image, JPEG_QUALITY)
+    quality = JPEG_QUALITY
+    if len(best) <= max_bytes:
+        return best, quality, size
+
+    low, high = JPEG_MIN_QUALITY, JPEG_QUALITY - 1
+    best, quality = None, JPEG_MIN_QUALITY
+    while low <= high:
+        mid = (low + high) // 2
+        data = encode_jpeg(image, mid)
+        if len(data) <= max_bytes:
+            best, quality = data, mid
+            low = mid + 1
+        else:
+            high = mid - 1
+
+    if best is None:
+        best = encode_jpeg(image, JPEG_MIN_QUALITY)
+    return best, quality, size
+
+
+def log_upload_savings(frames):
+    """Log bytes and estimated image tokens sent vs the uncropped full frames"""
+    sent = [frame for frame in frames if frame.jpeg is not None and frame.upload_size]
+    if not sent:
+        return
+
+    upload_bytes = sum(len(frame.jpeg) for frame in sent)
+    tokens = sum(estimate_image_tokens(*frame.upload_size) for frame in sent)
+    full_tokens = len(sent) * estimate_image_tokens(*CAPTURE_SIZE)
+
+    # Bytes for full frames at the same bits-per-pixel, for an approximate saving
+    full_pixels = CAPTURE_SIZE[0] * CAPTURE_SIZE[1]
+    full_bytes = sum(
+        len(frame.jpeg) * full_pixels / (frame.upload_size[0] * frame.upload_size[1])
+        for frame in sent
+    )
+    logger.info(
+        f"Upload: {len(sent)} images, {upload_bytes / 1024:.0f} KB "
+        f"(~{max(0.0, full_bytes - upload_bytes) / 1024:.0f} KB saved), "
+        f"~{tokens} image tokens (~{max(0, full_tokens - tokens)} saved)"
+    )
+
+
+def rgb_to_luma(rgb):
+    """BT.601 luma of an RGB array as float32"""
+    return rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def frame_luma(frame, step=SCORE_DOWNSAMPLE):
+    """Downsampled greyscale view of a frame as float32"""
+    if frame.lores is not None:
+        return frame.lores.astype(np.float32)
+
+    if frame.array is not None:
+        return rgb_to_luma(frame.array[::step, ::step])
+
+    image = Image.open(io.BytesIO(frame.jpeg))
+    image.draft("L", (image.width // step, image.height // step))  # fast DCT-domain scaling
+    return np.asarray(image.convert("L"), dtype=np.float32)
+
+
+def sharpness_score(luma):
+    """Variance of the Laplacian - higher means sharper"""
+    laplacian = (
+        luma[1:-1, :-2] + luma[1:-1, 2:] + luma[:-2, 1:-1] + luma[2:, 1:-1]
+        - 4.0 * luma[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def difference_hash(luma, hash_size=8):
+    """64-bit dHash: sign of horizontal gradients on a tiny thumbnail"""
+    thumbnail = Image.fromarray(luma).resize((hash_size + 1, hash_size), Image.BOX)
+    pixels = np.asarray(thumbnail)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def drop_duplicates(frames, max_distance=DEDUP_MAX_DISTANCE):
+    """Drop frames whose dHash is within max_distance of a kept frame
+
+    Frames are considered sharpest-first so each group of near-duplicates
+    keeps its best member. Returns (kept frames in capture order, dropped count).
+    """
+    if max_distance is None:
+        return frames, 0
+
+    kept = []
+    for frame in sorted(frames, key=lambda frame: frame.sharpness, reverse=True):
+        match = None
+        if frame.dhash is not None:
+            match = next(
+                (
+                    other for other in kept
+                    if other.dhash is not None
+                    and (frame.dhash ^ other.dhash).bit_count() <= max_distance
+                ),
+                None,
+            )
+        if match is not None:
+            match.duplicates.append(frame)  # still useful for fusion
+            continue
+        kept.append(frame)
+
+    kept.sort(key=lambda frame: frame.index)
+    return kept, len(frames) - len(kept)
+
+
+def select_sharpest(frames, top_k=UPLOAD_TOP_K):
+    """Keep the top_k sharpest frames, in capture order"""
+    if not top_k or len(frames) <= top_k:
+        return frames
+    best = sorted(frames, key=lambda frame: frame.sharpness, reverse=True)[:top_k]
+    return sorted(best, key=lambda frame: frame.index)
+
+
+def detect_page(luma, min_area=PAGE_MIN_AREA):
+    """Find the largest convex quadrilateral (the worksheet) in a luma image
+
+    Returns the corners as a (4, 2) float32 array ordered top-left, top-right,
+    bottom-right, bottom-left, or None if no plausible page is found.
+    """
+    cv2 = components.get("opencv")
+    grey = cv2.GaussianBlur(luma.astype(np.uint8), (5, 5), 0)
+    edges = cv2.dilate(cv2.Canny(grey, 50, 150), None)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_pixels = min_area * luma.shape[0] * luma.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        if cv2.contourArea(contour) < min_pixels:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return order_corners(approx.reshape(4, 2).astype(np.float32))
+    return None
+
+
+def order_corners(points):
+    """Order four points as top-left, top-right, bottom-right, bottom-left"""
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array(
+        [
+            points[np.argmin(sums)],
+            points[np.argmin(diffs)],
+            points[np.argmax(sums)],
+            points[np.argmax(diffs)],
+        ],
+        dtype=np.float32,
+    )
+
+
+def crop_page(frame):
+    """Perspective-correct the frame to its detected page, or return it as is"""
+    if frame.page_quad is None:
+        return frame.array
+
+    top_left, top_right, bottom_right, bottom_left = frame.page_quad
+    width = int(max(
+        np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left)
+    ))
+    height = int(max(
+        np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right)
+    ))
+    target = np.array(
+        [[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32
+    )
+    cv2 = components.get("opencv")
+    transform = cv2.getPerspectiveTransform(frame.page_quad, target)
+    return cv2.warpPerspective(frame.array, transform, (width, height), flags=cv2.INTER_AREA)
+
+
+def phase_correlation(reference, moving):
+    """Correlation surface whose peak at (dy, dx) means moving[y + dy, x + dx] ~ reference[y, x]"""
+    height, width = reference.shape
+    window = np.outer(np.hanning(height), np.hanning(width)).astype(np.float32)
+    spectrum_ref = np.fft.rfft2((reference - reference.mean()) * window)
+    spectrum_mov = np.fft.rfft2((moving - moving.mean()) * window)
+    cross = spectrum_mov * np.conj(spectrum_ref)
+    cross /= np.abs(cross) + 1e-9
+    return np.fft.irfft2(cross, s=reference.shape)
+
+
+def correlation_peak(correlation):
+    """(dy, dx) of the highest correlation, wrapped to signed shifts"""
+    height, width = correlation.shape
+    dy, dx = np.unravel_index(np.argmax(correlation), correlation.shape)
+    if dy > height // 2:
+        dy -= height
+    if dx > width // 2:
+        dx -= width
+    return int(dy), int(dx)
+
+
+def estimate_shift(reference, moving):
+    """Phase correlation: (dy, dx, peak) such that moving[y + dy, x + dx] ~ reference[y, x]
+
+    peak is the normalised correlation at the shift; near 0 means no match.
+    """
+    correlation = phase_correlation(reference, moving)
+    dy, dx = correlation_peak(correlation)
+    return dy, dx, float(correlation[dy, dx])
+
+
+def runner_up_ratio(correlation, dy, dx, radius=2):
+    """Highest correlation away from the peak at (dy, dx), as a fraction of it
+
+    Near 1 means another shift fits about as well, as with evenly spaced
+    rows of similar text, so the peak can't be trusted.
+    """
+    centred = np.roll(correlation, (radius - dy, radius - dx), axis=(0, 1))
+    peak = centred[radius, radius]
+    centred[:2 * radius + 1, :2 * radius + 1] = -np.inf
+    return float(centred.max() / peak) if peak > 0 else 1.0
+
+
+def parabola_offset(before, at, after):
+    """Sub-sample position of a peak from three samples around it"""
+    curvature = before - 2 * at + after
+    return float(0.5 * (before - after) / curvature) if curvature < 0 else 0.0
+
+
+def busiest_block(luma, block):
+    """(y, x) centre of the block x block tile of luma with the most contrast"""
+    rows, cols = luma.shape[0] // block, luma.shape[1] // block
+    if not rows or not cols:
+        return luma.shape[0] // 2, luma.shape[1] // 2
+    tiles = luma[:rows * block, :cols * block].reshape(rows, block, cols, block)
+    row, col = np.unravel_index(np.argmax(tiles.std(axis=(1, 3))), (rows, cols))
+    return int((row + 0.5) * block), int((col + 0.5) * block)
+
+
+def refine_shift(reference, moving, dy, dx, radius, centre, size=FUSE_REFINE_SIZE):
+    """Sub-pixel (dy, dx, match) of two full-resolution RGB frames near a coarse shift
+
+    Tries every integer shift within radius of (dy, dx) by normalised
+    correlation of a patch around centre, then fits a parabola through the
+    best score and its neighbours on each axis. match is the best score.
+    """
+    height, width = reference.shape[:2]
+    margin_y, margin_x = abs(dy) + radius, abs(dx) + radius
+    patch_h = min(size, height - 2 * margin_y)
+    patch_w = min(size, width - 2 * margin_x)
+    if patch_h < 16 or patch_w < 16:
+        return float(dy), float(dx), 0.0
+    top = int(np.clip(centre[0] - patch_h // 2, margin_y, height - margin_y - patch_h))
+    left = int(np.clip(centre[1] - patch_w // 2, margin_x, width - margin_x - patch_w))
+
+    target = rgb_to_luma(reference[top:top + patch_h, left:left + patch_w])
+    target -= target.mean()
+    target /= np.linalg.norm(target) + 1e-9
+    search = rgb_to_luma(
+        moving[
+            top + dy - radius:top + dy + radius + patch_h,
+            left + dx - radius:left + dx + radius + patch_w,
+        ]
+    )
+    scores = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=np.float32)
+    for oy in range(2 * radius + 1):
+        for ox in range(2 * radius + 1):
+            patch = search[oy:oy + patch_h, ox:ox + patch_w]
+            patch = patch - patch.mean()
+            scores[oy, ox] = (target * patch).sum() / (np.linalg.norm(patch) + 1e-9)
+
+    by, bx = np.unravel_index(np.argmax(scores), scores.shape)
+    fy = fx = 0.0
+    if 0 < by < 2 * radius:
+        fy = parabola_offset(scores[by - 1, bx], scores[by, bx], scores[by + 1, bx])
+    if 0 < bx < 2 * radius:
+        fx = parabola_offset(scores[by, bx - 1], scores[by, bx], scores[by, bx + 1])
+    return dy + by - radius + fy, dx + bx - radius + fx, float(scores[by, bx])
+
+
+def cubic_weights(fraction):
+    """Catmull-Rom taps for samples at -1, 0, 1 and 2 around a fractional position"""
+    f = fraction
+    return (
+        -0.5 * f**3 + f**2 - 0.5 * f,
+        1.5 * f**3 - 2.5 * f**2 + 1,
+        -1.5 * f**3 + 2 * f**2 + 0.5 * f,
+        0.5 * f**3 - 0.5 * f**2,
+    )
+
+
+def shifted_view(array, dy, dx, top, bottom, left, right, band=64):
+    """array[top + dy:bottom + dy, left + dx:right + dx], interpolated for fractional shifts
+
+    Bicubic, which keeps text edges far crisper than bilinear; needs one
+    pixel of margin before the region and two after it on each axis.
+    """
+    iy, ix = int(np.floor(dy)), int(np.floor(dx))
+    if dy == iy and dx == ix:
+        return array[top + iy:bottom + iy, left + ix:right + ix]
+
+    weights_y, weights_x = cubic_weights(dy - iy), cubic_weights(dx - ix)
+    height, width = bottom - top, right - left
+    view = np.empty((height, width) + array.shape[2:], dtype=np.uint8)
+    for start in range(0, height, band):
+        stop = min(start + band, height)
+        rows = array[
+            top + iy + start - 1:top + iy + stop + 2, left + ix - 1:right + ix + 2
+        ].astype(np.float32)
+        across = sum(weight * rows[:, k:k + width] for k, weight in enumerate(weights_x))
+        down = sum(weight * across[k:k + stop - start] for k, weight in enumerate(weights_y))
+        view[start:stop] = np.clip(down + 0.5, 0, 255)
+    return view
+
+
+def stack_arrays(arrays, method=FUSE_METHOD):
+    """Median or mean of equally sized uint8 images"""
+    if method == "mean":
+        total = np.zeros(arrays[0].shape, dtype=np.uint16)
+        for array in arrays:
+            total += array
+        return (total // len(arrays)).astype(np.uint8)
+
+    # Median in row bands keeps the float64 working set small
+    fused = np.empty_like(arrays[0])
+    band = 64
+    for start in range(0, fused.shape[0], band):
+        rows = np.stack([array[start:start + band] for array in arrays])
+        fused[start:start + band] = np.median(rows, axis=0)
+    return fused
+
+
+def fuse_frames(frames, max_frames=FUSE_MAX_FRAMES):
+    """Register the sharpest frames (and their duplicates) and stack them into one
+
+    Returns a new Frame based on the sharpest frame, or None if fewer than
+    two frames could be aligned.
+    """
+    candidates = [
+        candidate
+        for frame in frames
+        for candidate in [frame, *frame.duplicates]
+        if candidate.array is not None
+    ]
+    if len(candidates) < 2:
+        return None
+
+    candidates.sort(key=lambda frame: frame.sharpness, reverse=True)
+    reference = candidates[0]
+    reference_luma = frame_luma(reference)
+    scale = reference.array.shape[1] / reference_luma.shape[1]
+    max_shift = FUSE_MAX_SHIFT * reference.array.shape[1]
+    radius = int(np.ceil(scale)) + 1  # covers rounding plus a scoring pixel either way
+    block = max(1, round(FUSE_REFINE_SIZE / scale))
+    centre = [round(edge * scale) for edge in busiest_block(reference_luma, block)]
+
+    # Coarse shifts on the scoring luma, refined to sub-pixel at full resolution
+    aligned = [(reference, 0.0, 0.0)]
+    for frame in candidates[1:]:
+        if len(aligned) >= max_frames:
+            break
+        if frame.sharpness < FUSE_MIN_SHARPNESS * reference.sharpness:
+            break
+        correlation = phase_correlation(reference_luma, frame_luma(frame))
+        dy, dx = correlation_peak(correlation)
+        if correlation[dy, dx] < FUSE_MIN_CORRELATION:
+            continue
+        if runner_up_ratio(correlation, dy, dx) > FUSE_MAX_PEAK_RATIO:
+            continue
+        dy, dx, match = refine_shift(
+            reference.array, frame.array, round(dy * scale), round(dx * scale), radius, centre
+        )
+        if match >= FUSE_MIN_MATCH and max(abs(dy), abs(dx)) <= max_shift:
+            aligned.append((frame, dy, dx))
+    if len(aligned) < 2:
+        return None
+
+    # Crop every frame to the region all of them cover, in reference coordinates
+    height, width = reference.array.shape[:2]
+    top = max(1 - int(np.floor(dy)) for _, dy, _ in aligned)
+    left = max(1 - int(np.floor(dx)) for _, _, dx in aligned)
+    bottom = min(height - 2 - int(np.floor(dy)) for _, dy, _ in aligned)
+    right = min(width - 2 - int(np.floor(dx)) for _, _, dx in aligned)
+    views = [
+        shifted_view(frame.array, dy, dx, top, bottom, left, right)
+        for frame, dy, dx in aligned
+    ]
+
+    fused = Frame(
+        index=reference.index,
+        timestamp=reference.timestamp,
+        array=stack_arrays(views),
+        sharpness=reference.sharpness,
+        af_state=reference.af_state,
+        lens_position=reference.lens_position,
+    )
+    if reference.page_quad is not None:
+        fused.page_quad = reference.page_quad - np.array([left, top], dtype=np.float32)
+
+    logger.info(
+        f"Fused {len(aligned)} frames into frame {reference.index} ({FUSE_METHOD}, shifts "
+        + ", ".join(f"#{frame.index} {dx:+.1f},{dy:+.1f}" for frame, dy, dx in aligned[1:])
+        + ")"
+    )
+    return fused
+
+
+def ink_mask(grey, margin=4):
+    """Pixels clearly darker than their surroundings: text, lines and handwriting
+
+    A margin is cleared because the page crop leaves a sliver of desk along
+    its edges, which differs from shot to shot.
+    """
+    background = np.asarray(grey.filter(ImageFilter.BoxBlur(8)), dtype=np.float32)
+    mask = np.asarray(grey, dtype=np.float32) < background - 20
+    mask[:margin] = mask[-margin:] = False
+    mask[:, :margin] = mask[:, -margin:] = False
+    return mask
+
+
+def ink_density(mask, cell=2 * RESPONSE_CACHE_INK_TILE):
+    """Fraction of inked pixels in each cell, a coarse description of the page layout"""
+    rows, cols = mask.shape[0] // cell, mask.shape[1] // cell
+    return mask[:rows * cell, :cols * cell].reshape(rows, cell, cols, cell).mean(axis=(1, 3))
+
+
+def dilate(mask):
+    """Grow a boolean mask by one pixel in every direction"""
+    padded = np.pad(mask, 1)
+    height, width = mask.shape
+    grown = np.zeros_like(mask)
+    for dy in range(3):
+        for dx in range(3):
+            grown |= padded[dy:dy + height, dx:dx + width]
+    return grown
+
+
+def ink_difference(reference, other, tile=RESPONSE_CACHE_INK_TILE):
+    """Most unmatched ink pixels in any tile once other is aligned to reference
+
+    Strokes within a pixel of a stroke in the other mask count as matched,
+    which absorbs resampling and small cropping differences between shots,
+    while a changed digit or a filled-in answer leaves a tile of new ink.
+    """
+    dy, dx, _ = estimate_shift(reference.astype(np.float32), other.astype(np.float32))
+    height, width = reference.shape
+    reference = reference[max(0, -dy):height - max(0, dy), max(0, -dx):width - max(0, dx)]
+    other = other[max(0, dy):height + min(0, dy), max(0, dx):width + min(0, dx)]
+
+    unmatched = (reference & ~dilate(other)) | (other & ~dilate(reference))
+    rows, cols = unmatched.shape[0] // tile, unmatched.shape[1] // tile
+    tiles = unmatched[:rows * tile, :cols * tile].reshape(rows, tile, cols, tile)
+    return int(tiles.sum(axis=(1, 3)).max())
+
+
+def page_key(frame):
+    """Ink mask of the cropped worksheet, for recognising repeat captures"""
+    if frame.array is not None:
+        image = Image.fromarray(crop_page(frame))
+    elif frame.path is not None:
+        image = Image.open(frame.path)
+    else:
+        image = Image.fromarray(frame_luma(frame).astype(np.uint8))
+    return ink_mask(image.convert("L").resize(RESPONSE_CACHE_INK_SIZE, Image.BOX))
+
+
+def image_to_base64(frame):
+    """Convert image to base64 for API"""
+    try:
+        data = encode_frame(frame)
+        return base64.standard_b64encode(data).decode("utf-8")
+    except Exception as exc:
+        logger.error(f"Failed to encode frame {frame.index}: {exc}")
+        return None
+
+# =====================================================
+# SPECULATIVE UPLOAD
 # =====================================================
-CAPTURE_DIR.mkdir(parents=True, exist_ok=True)
-
-# Button
-button = Button(BUTTON_PIN, pull_up=True, bounce_time=0.1)
-logger.info("Button initialized on GPIO 27")
-
-# Haptics
-try:
-    i2c = busio.I2C(board.SCL, board.SDA)
-    drv = adafruit_drv2605.DRV2605(i2c)
-    HAPTICS_ENABLED = True
-    logger.info("Haptics initialized")
-except Exception as exc:
-    logger.warning(f"Haptics unavailable: {exc}")
-    HAPTICS_ENABLED = False
-
-# Camera
-picam = Picamera2()
-config = picam.create_still_configuration(
-    main={"size": (2304, 1296)},
-    buffer_count=4,
-)
-picam.configure(config)
-picam.start()
-logger.info("Camera initialized")
 
-# Anthropic API
-if not API_KEY:
-    logger.error("ANTHROPIC_API_KEY not set!")
-    raise SystemExit(1)
-
-client = Anthropic(api_key=API_KEY)
-logger.info("Claude API client initialized")
+def upload_frame(frame):
+    """Encode a frame and upload it with the Files API; returns the file id"""
+    jpeg = encode_frame(frame)
+    client = components.get("api")
+    with trace_span("upload"):
+        uploaded = client.beta.files.upload(
+            file=(f"{frame.timestamp}.jpg", jpeg, "image/jpeg"),
+            betas=[FILES_API_BETA],
+        )
+    logger.debug(f"Uploaded frame {frame.index} as {uploaded.id}")
+    return uploaded.id
 
-# =====================================================
-# HAPTIC FEEDBACK
-# =====================================================
 
-def _play_haptic_sequence(effects, pause_after=0.0):
-    if not HAPTICS_ENABLED:
-        return
+def delete_file(file_id):
     try:
-        for idx, effect in enumerate(effects):
-            drv.sequence[idx] = adafruit_drv2605.Effect(effect)
-        drv.play()
-        if pause_after:
-            time.sleep(pause_after)
-            drv.stop()
-    except Exception:
-        pass
+        components.get("api").beta.files.delete(file_id, betas=[FILES_API_BETA])
+    except Exception as exc:
+        logger.warning(f"Deleting uploaded file {file_id} failed: {exc}")
 
 
-def haptic_click():
-    """Single click - capture feedback"""
-    _play_haptic_sequence([11, 0])
+def delete_uploaded_files(request):
+    """Delete any Files API images a finished request referred to"""
+    for message in request["messages"]:
+        for block in message["content"]:
+            if block.get("type") == "image" and block["source"].get("type") == "file":
+                delete_file(block["source"]["file_id"])
 
 
-def haptic_double_click():
-    """Double click - API response received"""
-    _play_haptic_sequence([11, 11, 0], pause_after=0.25)
+class SpeculativeUploader:
+    """Uploads the burst's best frames so far while the button is still held
 
-# =====================================================
-# CAMERA FUNCTIONS
-# =====================================================
+    On release only frames that were never uploaded still need sending, and
+    uploads that fell out of the final selection are deleted.
+    """
 
-def autofocus_once():
-    """Perform autofocus"""
-    try:
-        picam.autofocus_cycle()
-        time.sleep(0.2)
-        logger.debug("Autofocus complete")
-    except Exception:
-        pass
+    def __init__(self, top_k, workers=2):
+        self._top_k = top_k or FRAME_POOL_SIZE
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._lock = threading.Lock()
+        self._best = []  # current top-K frames by sharpness
+        self._uploads = {}  # frame index -> Future of file id
 
+    def reset(self):
+        """Start a new burst, dropping any uploads the last one left behind"""
+        self.discard()
 
-def capture_burst():
-    """Capture images while button is held"""
-    logger.info("=== BURST STARTED ===")
-    captured_files = []
+    def discard(self):
+        """Drop every upload of this burst, e.g. when a cached answer makes them moot"""
+        with self._lock:
+            uploads, self._uploads = self._uploads, {}
+            self._best = []
+        if uploads:
+            self._drop(uploads.values())
+            logger.info(f"Speculative upload: discarded {len(uploads)} unused uploads")
 
-    # Focus once at start
-    autofocus_once()
+    def _drop(self, futures):
+        """Cancel uploads not yet started, wait out the rest, then delete their files"""
+        # Running uploads still read pool buffers, so let them finish first
+        stale = [future for future in futures if not future.cancel()]
+        wait(stale)
+        for future in stale:
+            if future.exception() is None:
+                self._executor.submit(delete_file, future.result())
 
-    # Capture while button held
-    while button.is_pressed:
-        try:
-            timestamp = int(time.time() * 1000)
-            filepath = CAPTURE_DIR / f"{timestamp}.jpg"
+    def consider(self, frame):
+        """Start uploading frame if it is among the sharpest seen so far"""
+        with self._lock:
+            self._best.append(frame)
+            self._best.sort(key=lambda best: best.sharpness, reverse=True)
+            del self._best[self._top_k:]
+            if any(best is frame for best in self._best):
+                self._uploads[frame.index] = self._executor.submit(upload_frame, frame)
 
-            picam.capture_file(str(filepath))
-            captured_files.append(filepath)
+    def finalize(self, frames):
+        """Return {frame index: file id} for frames, uploading any still missing"""
+        with self._lock:
+            uploads, self._uploads = self._uploads, {}
+            self._best = []
 
-            haptic_click()  # Shutter click feedback
-            logger.info(f"Captured: {filepath.name}")
+        reused = sum(1 for frame in frames if frame.index in uploads)
+        file_ids = {}
+        for frame in frames:
+            future = uploads.pop(frame.index, None)
+            try:
+                file_ids[frame.index] = future.result() if future else upload_frame(frame)
+            except Exception as exc:
+                logger.warning(f"Upload of frame {frame.index} failed, sending inline: {exc}")
 
-            time.sleep(BURST_DELAY)
+        self._drop(uploads.values())
+        logger.info(f"Speculative upload: {reused} of {len(frames)} frames already uploaded")
+        return file_ids
 
-        except Exception as exc:
-            logger.error(f"Capture failed: {exc}")
 
-    logger.info(f"=== BURST ENDED: {len(captured_files)} images ===")
-    return captured_files
+speculative_uploader = SpeculativeUploader(UPLOAD_TOP_K) if SPECULATIVE_UPLOAD else None
 
 # =====================================================
-# IMAGE PROCESSING
+# CLAUDE API
 # =====================================================
 
-def image_to_base64(filepath):
-    """Convert image to base64 for API"""
+# Sent as a cached system prompt. The API only caches prefixes above a
+# model-specific minimum (1024 tokens for Sonnet), so cache reads start once
+# this block grows past it; usage is logged per call either way.
+ANALYSIS_TASK = (
+    "TASK: Describe what you see in these images. Be specific about:\n"
+    "1. The overall scene/subject\n"
+    "2. Image quality (sharpness, lighting, focus)\n"
+    "3. Which image number appears clearest (if applicable)\n"
+    "4. Any text, objects, or details visible\n\n"
+    "Provide a clear, concise analysis."
+)
+# For a single (usually fused) image there is no clearest image to pick
+SINGLE_IMAGE_TASK = (
+    "TASK: Describe what you see in this image. Be specific about:\n"
+    "1. The overall scene/subject\n"
+    "2. Image quality (sharpness, lighting, focus)\n"
+    "3. Any text, objects, or details visible\n\n"
+    "Provide a clear, concise analysis."
+)
+
+def ping_api():
+    """Cheap authenticated round trip (no tokens); returns seconds or None"""
     try:
-        with open(filepath, "rb") as file_handle:
-            return base64.standard_b64encode(file_handle.read()).decode("utf-8")
+        client = components.get("api")  # a cold client is not part of the round trip
+        start = time.monotonic()
+        client.models.list(limit=1)
     except Exception as exc:
-        logger.error(f"Failed to encode {filepath}: {exc}")
+        logger.warning(f"API ping failed: {exc}")
         return None
+    return time.monotonic() - start
 
-# =====================================================
-# CLAUDE API
-# =====================================================
 
-def analyze_images(image_files):
-    """Send images to Claude API for analysis"""
-    if not image_files:
+def keep_api_warm():
+    """Open the API connection at startup and stop it idling out
+
+    Logs the cold (DNS + TCP + TLS) and first warm round trip for comparison.
+    """
+    cold = ping_api()
+    if cold is not None:
+        logger.info(f"API connection warmed: {cold * 1000:.0f} ms cold round trip")
+
+    reported_warm = False
+    while API_KEEPALIVE_INTERVAL:
+        time.sleep(API_KEEPALIVE_INTERVAL)
+        warm = ping_api()
+        if warm is not None and not reported_warm:
+            logger.info(f"API keep-alive: {warm * 1000:.0f} ms warm round trip")
+            reported_warm = True
+
+
+def messages_api(request):
+    """Beta messages endpoint when the request uses beta features (e.g. files)"""
+    client = components.get("api")
+    return client.beta.messages if "betas" in request else client.messages
+
+
+def log_usage(usage):
+    """Log input, prompt-cache write/read and output tokens for a call"""
+    if usage is None:
+        return
+    logger.info(
+        f"Tokens: input {usage.input_tokens}, "
+        f"cache write {getattr(usage, 'cache_creation_input_tokens', None) or 0}, "
+        f"cache read {getattr(usage, 'cache_read_input_tokens', None) or 0}, "
+        f"output {usage.output_tokens}"
+    )
+
+
+def stream_response(request, on_text, trace=None):
+    """Stream a completion, passing text to on_text as it arrives
+
+    Logs time-to-first-token and total latency; returns the full text.
+    """
+    start = time.monotonic()
+    first_token = None
+    chunks = []
+    with messages_api(request).stream(**request) as stream:
+        for text in stream.text_stream:
+            if first_token is None:
+                first_token = time.monotonic() - start
+                if trace:
+                    trace.add("api_first_token", start, start + first_token)
+            chunks.append(text)
+            if on_text:
+                on_text(text)
+        log_usage(stream.get_final_message().usage)
+
+    total = time.monotonic() - start
+    if trace:
+        trace.add("api_complete", start, start + total)
+    ttft = f"{first_token:.2f}s" if first_token is not None else "n/a"
+    logger.info(f"API response streamed: TTFT {ttft}, total {total:.2f}s")
+    return "".join(chunks)
+
+
+def build_request(frames):
+    """Select, fuse and encode frames into an API request
+
+    Everything that touches frame buffers happens here, so the frame pool
+    can be reused as soon as this returns.
+    """
+    if not frames:
         logger.warning("No images to analyze")
         return None
 
-    logger.info(f"Analyzing {len(image_files)} images with Claude...")
+    selected = select_sharpest(frames)
+    if len(selected) < len(frames):
+        logger.info(
+            f"Selected {len(selected)} of {len(frames)} frames by sharpness: "
+            + ", ".join(f"#{frame.index} ({frame.sharpness:.1f})" for frame in selected)
+        )
+    frames = selected
+
+    # Speculative uploads are of individual frames, so they skip fusion
+    fused = None
+    if FUSE_FRAMES and not speculative_uploader:
+        fused = fuse_frames(frames)
+        if fused is not None:
+            frames = [fused]
+
+    logger.info(f"Analyzing {len(frames)} images with Claude...")
 
     try:
+        file_ids = speculative_uploader.finalize(frames) if speculative_uploader else {}
+
         # Prepare message content with all images
         content = []
 
         # Add all images
-        for idx, img_path in enumerate(image_files, 1):
-            base64_image = image_to_base64(img_path)
+        for idx, frame in enumerate(frames, 1):
+            if frame.index in file_ids:
+                content.append(
+                    {
+                        "type": "image",
+                        "source": {"type": "file", "file_id": file_ids[frame.index]},
+                    }
+                )
+                continue
+
+            base64_image = image_to_base64(frame)
             if base64_image:
                 content.append(
                     {
@@ -183,98 +1855,875 @@ def analyze_images(image_files):
                         },
                     }
                 )
-                logger.debug(f"Added image {idx} to request")
+                logger.debug(
+                    f"Added image {idx}: {frame.source_size} -> {frame.upload_size} "
+                    f"at q{frame.upload_quality}, {len(frame.jpeg) / 1024:.0f} KB"
+                )
+
+        log_upload_savings(frames)
 
         # Add text prompt
+        if len(frames) > 1:
+            subject = f"{len(frames)} burst photos of the same scene"
+        elif fused is not None:
+            subject = "one photo stacked from a burst of the same scene"
+        else:
+            subject = "one photo"
         content.append(
             {
                 "type": "text",
-                "text": (
-                    "You are analyzing "
-                    f"{len(image_files)} burst photos of the same scene.\n\n"
-                    "TASK: Describe what you see in these images. Be specific about:\n"
-                    "1. The overall scene/subject\n"
-                    "2. Image quality (sharpness, lighting, focus)\n"
-                    "3. Which image number appears clearest (if applicable)\n"
-                    "4. Any text, objects, or details visible\n\n"
-                    "Provide a clear, concise analysis."
-                ),
+                "text": f"You are analyzing {subject}.",
             }
         )
 
-        # Make API call
-        logger.info("Sending request to Claude API...")
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1024,
-            messages=[
+        request = {
+            "model": MODEL,
+            "max_tokens": MAX_TOKENS,
+            "system": [
+                {
+                    "type": "text",
+                    "text": ANALYSIS_TASK if len(frames) > 1 else SINGLE_IMAGE_TASK,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+            "messages": [
                 {
                     "role": "user",
                     "content": content,
                 }
             ],
-        )
+        }
+        if file_ids:
+            request["betas"] = [FILES_API_BETA]
+        return request
+
+    except Exception as exc:
+        logger.error(f"Preparing request failed: {exc}")
+        return None
+
+
+def call_api(request, on_text=None, trace=None):
+    """Send a prepared request to Claude and return the answer text
+
+    When streaming, on_text(chunk) is called as the answer is generated.
+    Raises on failure.
+    """
+    logger.info("Sending request to Claude API...")
+    if STREAM_RESPONSES:
+        return stream_response(request, on_text, trace)
+
+    start = time.monotonic()
+    response = messages_api(request).create(**request)
+    if trace:
+        trace.add("api_complete", start, time.monotonic())
 
-        # Extract response
-        response_text = response.content[0].text
-        logger.info("API response received")
+    # Extract response
+    response_text = response.content[0].text
+    logger.info(f"API response received in {time.monotonic() - start:.2f}s")
+    log_usage(response.usage)
 
-        return response_text
+    return response_text
 
+
+def send_request(request, on_text=None, trace=None):
+    """call_api(), logging failures and returning None"""
+    try:
+        return call_api(request, on_text, trace)
     except Exception as exc:
         logger.error(f"API call failed: {exc}")
         return None
 
+
+def analyze_images(frames, on_text=None):
+    """Send images to Claude API for analysis"""
+    trace = current_trace
+    try:
+        with trace_span("cache_lookup"):
+            cache_key = worksheet_key(frames)
+            cached = lookup_response(cache_key)
+        if cached is not None:
+            if speculative_uploader:
+                speculative_uploader.discard()
+            return replay_response(cached, on_text)
+
+        with trace_span("build"):
+            request = build_request(frames)
+        if request is None:
+            return None
+        response_text = send_request(request, on_text, trace)
+        delete_uploaded_files(request)
+        return store_response(cache_key, response_text)
+    finally:
+        if trace:
+            trace.save()
+
+# =====================================================
+# JOB QUEUE
+# =====================================================
+
+@dataclass
+class Job:
+    """A prepared API request persisted until it is answered"""
+    id: int
+    request: dict
+    attempts: int = 0
+    next_attempt: float = 0.0
+
+
+class JobQueue:
+    """Durable SQLite queue of requests that still need an answer
+
+    Jobs survive crashes and power loss; answered jobs are deleted, jobs
+    that exhaust their retries are kept with status 'failed', up to keep_failed.
+    """
+
+    def __init__(self, path, keep_failed):
+        self._keep_failed = keep_failed
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created REAL NOT NULL,
+                request TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending',
+                last_error TEXT
+            )
+            """
+        )
+
+    def add(self, request):
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (created, request) VALUES (?, ?)",
+                (time.time(), json.dumps(request)),
+            )
+        return Job(id=cursor.lastrowid, request=request)
+
+    def pending(self):
+        """Jobs left over from earlier runs, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, request, attempts, next_attempt FROM jobs "
+                "WHERE status = 'pending' ORDER BY id"
+            ).fetchall()
+        return [
+            Job(id=row[0], request=json.loads(row[1]), attempts=row[2], next_attempt=row[3])
+            for row in rows
+        ]
+
+    def complete(self, job):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def retry(self, job, error):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (job.attempts, job.next_attempt, error, job.id),
+            )
+
+    def fail(self, job, error):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET attempts = ?, status = 'failed', last_error = ? WHERE id = ?",
+                (job.attempts, error, job.id),
+            )
+            # Failed rows still hold their base64 images, so only keep the latest few
+            self._db.execute(
+                "DELETE FROM jobs WHERE status = 'failed' AND id NOT IN "
+                "(SELECT id FROM jobs WHERE status = 'failed' ORDER BY id DESC LIMIT ?)",
+                (self._keep_failed,),
+            )
+
+
+def init_job_queue():
+    JOB_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    return JobQueue(JOB_DB_PATH, JOB_KEEP_FAILED)
+
+
+components.register("job_queue", init_job_queue)
+api_slots = threading.BoundedSemaphore(API_CONCURRENCY)
+
+
+# Error types the API may send as an SSE event after the response has started
+RETRYABLE_STREAM_ERRORS = ("overloaded_error", "api_error", "rate_limit_error", "timeout_error")
+
+
+def is_retryable(exc):
+    """Connection problems, timeouts, rate limits and server errors are transient"""
+    import httpx  # already loaded by the API client
+    from anthropic import APIConnectionError
+
+    # Raw read errors surface unwrapped while iterating a stream
+    if isinstance(exc, (APIConnectionError, httpx.TransportError)):
+        return True
+
+    # A mid-stream error event arrives on a 200 response; its type says what failed
+    body = getattr(exc, "body", None)
+    if isinstance(body, dict):
+        error = body.get("error") if isinstance(body.get("error"), dict) else body
+        if error.get("type") in RETRYABLE_STREAM_ERRORS:
+            return True
+
+    status = getattr(exc, "status_code", None)
+    return status in (408, 409, 429) or (status is not None and status >= 500)
+
+
+def backoff_delay(attempts):
+    """Exponential backoff with equal jitter"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def run_job(job, on_text=None, trace=None):
+    """Send a queued request until it is answered or retries run out
+
+    If an attempt fails after part of the answer reached on_text, the retry
+    prefills that part as the assistant turn, so the model continues where
+    it stopped and nothing is printed or spoken twice.
+    """
+    delivered = []
+
+    def forward(text):
+        delivered.append(text)
+        on_text(text)
+
+    while True:
+        wait = job.next_attempt - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+        request = job.request
+        partial = "".join(delivered).rstrip()  # the API rejects trailing whitespace
+        if partial:
+            continuation = {"role": "assistant", "content": partial}
+            request = {**job.request, "messages": [*job.request["messages"], continuation]}
+
+        try:
+            with api_slots:
+                response_text = call_api(request, forward if on_text else None, trace)
+            components.get("job_queue").complete(job)
+            delete_uploaded_files(job.request)
+            return partial + response_text if partial else response_text
+
+        except Exception as exc:
+            job.attempts += 1
+            if not is_retryable(exc) or job.attempts >= JOB_MAX_ATTEMPTS:
+                components.get("job_queue").fail(job, str(exc))
+                delete_uploaded_files(job.request)
+                logger.error(
+                    f"API call failed for job {job.id} after {job.attempts} attempts: {exc}"
+                )
+                return None
+
+            delay = backoff_delay(job.attempts)
+            job.next_attempt = time.time() + delay
+            components.get("job_queue").retry(job, str(exc))
+            logger.warning(
+                f"API call failed for job {job.id} ({exc}), retry {job.attempts} in {delay:.1f}s"
+            )
+
+# =====================================================
+# RESPONSE CACHE
+# =====================================================
+
+class ResponseCache:
+    """Answers keyed by worksheet, matched on the writing on the page
+
+    A stored sheet is a candidate when no cell of its ink density differs by
+    more than max_density. Only the max_compare closest candidates have their
+    ink masks aligned, and one matches when no tile of the aligned masks
+    differs by more than max_ink pixels; densities are stored alongside the
+    masks so the ranking never touches them. Entries are scoped to the model
+    and prompt, expire after a TTL and are evicted least-recently-used beyond
+    a maximum count.
+    """
+
+    def __init__(self, path, max_entries, ttl, max_density, max_ink, max_compare):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._max_density = max_density
+        self._max_ink = max_ink
+        self._max_compare = max_compare
+        prompt = (
+            f"{MODEL}\0{ANALYSIS_TASK}\0{SINGLE_IMAGE_TASK}\0"
+            f"{RESPONSE_CACHE_INK_SIZE}\0{RESPONSE_CACHE_INK_TILE}"
+        )
+        self._version = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(responses)")]
+        if columns and "density" not in columns:
+            self._db.execute("DROP TABLE responses")  # an older key format
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                version TEXT NOT NULL,
+                density BLOB NOT NULL,
+                ink BLOB NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                response TEXT NOT NULL
+            )
+            """
+        )
+
+    def lookup(self, key):
+        """Cached answer for the same worksheet, or None"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self._ttl,))
+            rows = self._db.execute(
+                "SELECT id, density FROM responses WHERE version = ?", (self._version,)
+            ).fetchall()
+
+            density = ink_density(key).astype(np.float32).ravel()
+            candidates = []
+            for row_id, stored_density in rows:
+                distance = np.abs(np.frombuffer(stored_density, dtype=np.float32) - density).max()
+                if distance <= self._max_density:
+                    candidates.append((float(distance), row_id))
+            candidates.sort()
+
+            best = None
+            for _, row_id in candidates[:self._max_compare]:
+                stored_ink, response = self._db.execute(
+                    "SELECT ink, response FROM responses WHERE id = ?", (row_id,)
+                ).fetchone()
+                ink = np.unpackbits(
+                    np.frombuffer(stored_ink, dtype=np.uint8), count=key.size
+                ).reshape(key.shape).astype(bool)
+                difference = ink_difference(key, ink)
+                if difference <= self._max_ink and (best is None or difference < best[0]):
+                    best = (difference, row_id, response)
+
+            if best is None:
+                self.misses += 1
+                logger.info(f"Response cache miss ({self.hits} hits, {self.misses} misses)")
+                return None
+
+            difference, row_id, response = best
+            self._db.execute("UPDATE responses SET last_used = ? WHERE id = ?", (now, row_id))
+            self.hits += 1
+            logger.info(
+                f"Response cache hit, {difference} unmatched ink pixels "
+                f"({self.hits} hits, {self.misses} misses)"
+            )
+            return response
+
+    def store(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO responses (version, density, ink, created, last_used, response) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self._version,
+                    ink_density(key).astype(np.float32).tobytes(),
+                    np.packbits(key).tobytes(),
+                    now,
+                    now,
+                    response,
+                ),
+            )
+            self._db.execute(
+                "DELETE FROM responses WHERE id NOT IN "
+                "(SELECT id FROM responses ORDER BY last_used DESC LIMIT ?)",
+                (self._max_entries,),
+            )
+
+
+def init_response_cache():
+    """The response cache, or None when caching is off"""
+    if not RESPONSE_CACHE_MAX_ENTRIES:
+        return None
+    RESPONSE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    return ResponseCache(
+        RESPONSE_CACHE_PATH,
+        RESPONSE_CACHE_MAX_ENTRIES,
+        RESPONSE_CACHE_TTL,
+        RESPONSE_CACHE_MAX_DENSITY,
+        RESPONSE_CACHE_MAX_INK,
+        RESPONSE_CACHE_MAX_COMPARE,
+    )
+
+
+components.register("response_cache", init_response_cache)
+
+
+def worksheet_key(frames):
+    """Page key of the sharpest frame, or None when caching is off"""
+    if components.get("response_cache") is None or not frames:
+        return None
+    try:
+        return page_key(max(frames, key=lambda frame: frame.sharpness))
+    except Exception as exc:
+        logger.warning(f"Hashing worksheet failed: {exc}")
+        return None
+
+
+def lookup_response(cache_key):
+    if cache_key is None:
+        return None
+    return components.get("response_cache").lookup(cache_key)
+
+
+def store_response(cache_key, response_text):
+    """Cache a successful answer; returns it unchanged"""
+    if cache_key is not None and response_text:
+        components.get("response_cache").store(cache_key, response_text)
+    return response_text
+
+
+def answer_job(job, cache_key, trace=None, on_text=None):
+    """run_job(), caching the answer under the worksheet's page key"""
+    return store_response(cache_key, run_job(job, on_text, trace))
+
+
+def replay_response(response_text, on_text=None):
+    """Hand a cached answer to on_text as if it had streamed"""
+    if on_text and STREAM_RESPONSES:
+        on_text(response_text)
+    return response_text
+
+# =====================================================
+# VOICE OUTPUT
+# =====================================================
+
+SENTENCE_END = re.compile(r"(?<=[.!?:])\s+|\n+")
+MARKDOWN_NOISE = re.compile(r"[*_#`>|]+")
+
+
+def synthesize(text):
+    """Render text to WAV bytes with the offline TTS engine"""
+    if TTS_ENGINE == "piper":
+        result = subprocess.run(
+            ["piper", "--model", TTS_VOICE, "--output_raw"],
+            input=text.encode("utf-8"),
+            capture_output=True,
+            check=True,
+        )
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(PIPER_SAMPLE_RATE)
+            wav.writeframes(result.stdout)
+        return buffer.getvalue()
+
+    # Text goes on stdin so a leading "-" (bullets, negative numbers) isn't read as an option
+    result = subprocess.run(
+        ["espeak-ng", "-v", TTS_VOICE, "-s", str(TTS_RATE), "--stdout", "--stdin"],
+        input=text.encode("utf-8"),
+        capture_output=True,
+        check=True,
+    )
+    return result.stdout
+
+
+class AudioCache:
+    """Content-addressed WAV cache on disk with size-bounded LRU eviction
+
+    Entries are keyed by text + engine + voice + rate. Recency survives
+    restarts through file modification times.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        directory.mkdir(parents=True, exist_ok=True)
+        files = sorted(directory.glob("*.wav"), key=lambda path: path.stat().st_mtime)
+        self._entries = OrderedDict((path.stem, path.stat().st_size) for path in files)
+        self._total_bytes = sum(self._entries.values())
+
+    def _key(self, text):
+        voice = f"{TTS_ENGINE}\0{TTS_VOICE}\0{TTS_RATE}\0{text}"
+        return hashlib.sha256(voice.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return self._directory / f"{key}.wav"
+
+    def get(self, text):
+        """Return cached WAV bytes for text, or None"""
+        key = self._key(text)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        path = self._path(key)
+        try:
+            os.utime(path)
+            return path.read_bytes()
+        except OSError:
+            with self._lock:
+                self._total_bytes -= self._entries.pop(key, 0)
+            return None
+
+    def put(self, text, wav_bytes):
+        key = self._key(text)
+        path = self._path(key)
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_bytes(wav_bytes)
+        temp_path.replace(path)  # atomic, so readers never see partial audio
+
+        with self._lock:
+            self._total_bytes += len(wav_bytes) - self._entries.pop(key, 0)
+            self._entries[key] = len(wav_bytes)
+            while self._total_bytes > self._max_bytes and len(self._entries) > 1:
+                oldest, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                self._path(oldest).unlink(missing_ok=True)
+
+
+def init_tts_cache():
+    """The spoken-phrase cache, or None when voice output or caching is off"""
+    if not TTS_ENABLED or not TTS_CACHE_MAX_BYTES:
+        return None
+    return AudioCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+
+
+components.register("tts_cache", init_tts_cache)
+
+
+def synthesize_cached(text):
+    """synthesize(), served from the audio cache when the phrase was spoken before"""
+    tts_cache = components.get("tts_cache")
+    if tts_cache is None:
+        return synthesize(text)
+
+    wav_bytes = tts_cache.get(text)
+    if wav_bytes is None:
+        wav_bytes = synthesize(text)
+        try:
+            tts_cache.put(text, wav_bytes)
+        except OSError as exc:
+            logger.warning(f"Caching speech failed: {exc}")  # still speak it
+    return wav_bytes
+
+
+def play_audio(wav_bytes):
+    """Play WAV bytes through ALSA, blocking until done"""
+    subprocess.run(["aplay", "-q", "-"], input=wav_bytes, check=True)
+
+
+class SpeechPipeline:
+    """Speaks streamed text sentence by sentence
+
+    Sentence N plays while sentence N+1 is synthesized and later text is
+    still arriving from the API.
+    """
+
+    def __init__(self, trace=None):
+        self._trace = trace
+        self._pending = ""
+        self._sentences = queue.Queue()
+        self._audio = queue.Queue(maxsize=2)
+        self._threads = [
+            threading.Thread(target=self._synthesize_loop, name="tts-synth", daemon=True),
+            threading.Thread(target=self._play_loop, name="tts-play", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def feed(self, text):
+        """Add streamed text; complete sentences are queued for speech"""
+        self._pending += text
+        *sentences, self._pending = SENTENCE_END.split(self._pending)
+        for sentence in sentences:
+            self._queue_sentence(sentence)
+
+    def finish(self):
+        """Speak any trailing text and wait for playback to end"""
+        self._queue_sentence(self._pending)
+        self._pending = ""
+        self._sentences.put(None)
+        for thread in self._threads:
+            thread.join()
+        tts_cache = components.get("tts_cache")
+        if tts_cache:
+            logger.info(f"TTS cache: {tts_cache.hits} hits, {tts_cache.misses} misses")
+
+    def _queue_sentence(self, sentence):
+        sentence = " ".join(MARKDOWN_NOISE.sub(" ", sentence).split())
+        if sentence:
+            self._sentences.put(sentence)
+
+    def _synthesize_loop(self):
+        while True:
+            sentence = self._sentences.get()
+            if sentence is None:
+                self._audio.put(None)
+                return
+            try:
+                self._audio.put(synthesize_cached(sentence))
+            except Exception as exc:
+                logger.error(f"Speech synthesis failed: {exc}")
+
+    def _play_loop(self):
+        while True:
+            wav_bytes = self._audio.get()
+            if wav_bytes is None:
+                return
+            if self._trace:
+                self._trace.mark("first_audio")
+                self._trace = None
+            try:
+                play_audio(wav_bytes)
+            except Exception as exc:
+                logger.error(f"Audio playback failed: {exc}")
+
 # =====================================================
 # MAIN LOOP
 # =====================================================
 
-def main():
-    logger.info("=" * 60)
-    logger.info("WORKSHEET CAPTURE & ANALYSIS SYSTEM")
-    logger.info("Hold button to capture burst, release to analyze")
-    logger.info("Images saved to: " + str(CAPTURE_DIR))
+def show_analysis_header():
+    logger.info("\n" + "=" * 60)
+    logger.info("CLAUDE'S ANALYSIS:")
     logger.info("=" * 60)
 
+
+def stream_to_console(speech=None):
+    """on_text callback that prints the header, then each chunk as it arrives
+
+    Chunks are also fed to speech, if given.
+    """
+    started = False
+
+    def on_text(text):
+        nonlocal started
+        if not started:
+            show_analysis_header()
+            print()
+            started = True
+        print(text, end="", flush=True)
+        if speech:
+            speech.feed(text)
+
+    return on_text
+
+
+async def deliver_analysis(fetch, previous_delivery, pending, trace):
+    """Fetch one answer and present it after the previous one
+
+    fetch(on_text) runs immediately in an executor (an API job or a cache
+    replay); its streamed text is buffered until the previous answer has
+    finished printing and speaking. The session trace is saved at the end.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    try:
+        request_done = loop.run_in_executor(
+            None,
+            fetch,
+            lambda text: loop.call_soon_threadsafe(chunks.put_nowait, text),
+        )
+        request_done.add_done_callback(lambda _: chunks.put_nowait(None))
+
+        # Results are delivered in capture order
+        if previous_delivery:
+            with trace.span("wait_previous"):
+                await asyncio.wait({previous_delivery})
+
+        speech = SpeechPipeline(trace) if TTS_ENABLED else None
+        on_text = stream_to_console(speech)
+        while (text := await chunks.get()) is not None:
+            on_text(text)
+        response = await request_done
+
+        if response:
+            # Success feedback
+            haptic_double_click()
+
+            # Display response (already printed and spoken as it streamed)
+            if STREAM_RESPONSES:
+                print("\n")
+            else:
+                show_analysis_header()
+                print(f"\n{response}\n")
+                if speech:
+                    speech.feed(response)
+            logger.info("=" * 60)
+        else:
+            logger.error("Analysis failed")
+
+        if speech:
+            with trace.span("playback_drain"):
+                await loop.run_in_executor(None, speech.finish)
+    finally:
+        pending.release()
+        trace.save()
+
+
+async def run():
+    """Capture bursts while earlier analyses are still in flight"""
+    loop = asyncio.get_running_loop()
+    pending = asyncio.Semaphore(MAX_PENDING_ANALYSES)
+    delivery = None
+
+    # Bridge the GPIO callback thread into the event loop
+    pressed = asyncio.Event()
+    pressed_at = None
+
+    def on_press(timestamp):
+        nonlocal pressed_at
+        pressed_at = timestamp
+        pressed.set()
+
+    button = components.get("button")
+    button.when_pressed = lambda: loop.call_soon_threadsafe(on_press, time.monotonic())
+
+    # Finish work left over from a previous run first
+    for job in components.get("job_queue").pending():
+        logger.info(f"Resuming queued job {job.id} (attempt {job.attempts + 1})")
+        await pending.acquire()
+        trace = Trace()
+        delivery = asyncio.create_task(
+            deliver_analysis(
+                functools.partial(answer_job, job, None, trace), delivery, pending, trace
+            )
+        )
+
     try:
         while True:
             # Wait for button press
             logger.info("\n[READY] Waiting for button press...")
-            button.wait_for_press()
+            await pressed.wait()
+            pressed.clear()
 
             # Capture burst
-            captured_files = capture_burst()
+            frames = await loop.run_in_executor(None, capture_burst, pressed_at)
+            trace = current_trace
 
-            if not captured_files:
+            if not frames:
                 logger.warning("No images captured")
+                trace.save()
                 continue
 
-            # Analyze with Claude
+            # Seen this worksheet before? Answer without the API
+            with trace.span("cache_lookup"):
+                cache_key = await loop.run_in_executor(None, worksheet_key, frames)
+                cached = await loop.run_in_executor(None, lookup_response, cache_key)
+            if cached is not None:
+                if speculative_uploader:
+                    await loop.run_in_executor(None, speculative_uploader.discard)
+                await pending.acquire()
+                delivery = asyncio.create_task(
+                    deliver_analysis(
+                        functools.partial(replay_response, cached), delivery, pending, trace
+                    )
+                )
+                continue
+
+            # Encode now so the frame pool is free for the next burst
+            with trace.span("build"):
+                request = await loop.run_in_executor(None, build_request, frames)
+            if request is None:
+                logger.error("Analysis failed")
+                trace.save()
+                continue
+
+            # Persist, then analyze with Claude in the background
             logger.info("\n[ANALYZING] Sending to Claude API...")
-            response = analyze_images(captured_files)
+            await pending.acquire()
+            job = components.get("job_queue").add(request)
+            delivery = asyncio.create_task(
+                deliver_analysis(
+                    functools.partial(answer_job, job, cache_key, trace),
+                    delivery,
+                    pending,
+                    trace,
+                )
+            )
+    finally:
+        button.when_pressed = None
 
-            if response:
-                # Success feedback
-                haptic_double_click()
 
-                # Display response
-                logger.info("\n" + "=" * 60)
-                logger.info("CLAUDE'S ANALYSIS:")
-                logger.info("=" * 60)
-                print(f"\n{response}\n")
-                logger.info("=" * 60)
-            else:
-                logger.error("Analysis failed")
+def log_startup(threads, imported):
+    """Report startup once every background component is up"""
+    for thread in threads:
+        thread.join()
+    uptime = process_uptime()
+    if uptime is not None:
+        logger.info(
+            f"All components up {uptime:.2f}s after launch "
+            f"(imports {imported:.2f}s; {components.report()})"
+        )
+
+
+def main():
+    imported = process_uptime()
+    if BACKEND != "sim" and not API_KEY:
+        logger.error("ANTHROPIC_API_KEY not set!")
+        raise SystemExit(1)
+
+    logger.info("=" * 60)
+    logger.info("WORKSHEET CAPTURE & ANALYSIS SYSTEM")
+    logger.info("Hold button to capture burst, release to analyze")
+    logger.info("Images saved to: " + str(CAPTURE_DIR))
+    logger.info("=" * 60)
 
-            # Brief pause before next capture
-            time.sleep(1)
+    # The button alone makes the device usable; everything else comes up behind it
+    components.get("button")
+    ready = process_uptime()
+    if ready is not None:
+        logger.info(f"Ready {ready:.2f}s after launch (imports {imported:.2f}s)")
+    threads = components.start(
+        [
+            "camera",
+            "pretrigger",
+            "haptics",
+            "api",
+            "opencv",
+            "capture_dir",
+            "response_cache",
+            "tts_cache",
+        ]
+    )
+    threading.Thread(target=log_startup, args=(threads, imported), daemon=True).start()
+
+    # Connect to the API now rather than when the first burst ends
+    threading.Thread(target=keep_api_warm, name="api-keepalive", daemon=True).start()
+
+    try:
+        asyncio.run(run())
 
     except KeyboardInterrupt:
         logger.info("\n\nShutting down...")
-        picam.stop()
-        picam.close()
+        picam = components.get("camera", wait=False)
+        if picam is not None:
+            picam.stop()
+            picam.close()
         logger.info("Goodbye!")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Worksheet capture & AI analysis")
+    parser.add_argument(
+        "--latency-report",
+        type=int,
+        nargs="?",
+        const=20,
+        metavar="N",
+        help="print per-stage latency percentiles over the last N sessions and exit",
+    )
+    args = parser.parse_args()
+
+    if args.latency_report:
+        print(latency_report(args.latency_report))
+    else:
+        main()